@@ -0,0 +1,66 @@
+"""
+Benchmarks the image conversion functions on a synthetic corpus.
+Each case runs in a fresh process, so peak RSS is measured per case.
+
+Usage (from the repo root): python -m benchmarks.bench_imaging [--repeat N]
+"""
+import argparse
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from PIL import Image
+
+# src.globals requires these, but nothing here talks to discord
+os.environ.setdefault("DISCORD_MOTE_BOT_TOKEN", "")
+os.environ.setdefault("BOT_TEST_TOKEN", "")
+os.environ.setdefault("BOT_INVITE_LINK", "")
+
+from benchmarks.corpus import build_corpus
+from src.globals import MAX_EMOTE_SIZE_BYTES
+from src import imaging
+
+
+CASES = ("convert_discord_img", "resize_img", "get_optimal_frame_size")
+
+
+def run_case(func_name: str, content: bytes, repeat: int) -> tuple[float, int, int, bool]:
+    """ returns: (avg_wall_secs, peak_rss_kib, output_bytes, fits) """
+    output_bytes = 0
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        if func_name == "get_optimal_frame_size":
+            imaging.get_optimal_frame_size(Image.open(BytesIO(content)))
+            output = b""
+        else:
+            output, err = getattr(imaging, func_name)(content)
+            if err:
+                raise RuntimeError(err)
+        output_bytes = len(output)
+    wall_secs = (time.perf_counter() - start_time) / repeat
+    peak_rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    fits = func_name == "get_optimal_frame_size" or output_bytes <= MAX_EMOTE_SIZE_BYTES
+    return wall_secs, peak_rss_kib, output_bytes, fits
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = build_corpus()
+    print(f"{'input':<22}{'in bytes':>10}  {'function':<24}{'wall (s)':>9}{'peak RSS (MiB)':>16}{'out bytes':>11}  fits")
+    fit_counts = {case: 0 for case in CASES}
+    for name, content in corpus.items():
+        for func_name in CASES:
+            with ProcessPoolExecutor(max_workers=1) as executor: # fresh process, so ru_maxrss is just this case
+                wall_secs, peak_rss_kib, output_bytes, fits = executor.submit(run_case, func_name, content, args.repeat).result()
+            fit_counts[func_name] += fits
+            print(f"{name:<22}{len(content):>10}  {func_name:<24}{wall_secs:>9.3f}{peak_rss_kib / 1024:>16.1f}{output_bytes:>11}  {'yes' if fits else 'NO'}")
+    for func_name in CASES[:2]:
+        print(f"{func_name} fit rate under {MAX_EMOTE_SIZE_BYTES} bytes: {fit_counts[func_name]}/{len(corpus)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Replays grab/upload/steal end to end against local stand-ins for the 7TV API, the 7TV and discord CDNs,
+and discord's emoji endpoint, reporting throughput and latency at N concurrent commands.
+
+Usage (from the repo root): python -m benchmarks.bench_pipeline [--concurrency N] [--commands N] [--distinct-emotes N]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import time
+from types import SimpleNamespace
+
+# src.globals requires these, but nothing here talks to discord
+os.environ.setdefault("DISCORD_MOTE_BOT_TOKEN", "")
+os.environ.setdefault("BOT_TEST_TOKEN", "")
+os.environ.setdefault("BOT_INVITE_LINK", "")
+
+from aiohttp import web
+from benchmarks.corpus import make_animated_gif, make_static_png
+from src.admission import AdmissionController
+from src.cogs.commands import Commands
+from src.emote_cache import EmoteCache
+from src.emoji_index import EmojiIndex
+from src.globals import MAX_EMOTE_SIZE_BYTES
+from src.http_client import HttpClient
+from src.image_pool import ImagePool
+from src.single_flight import SingleFlight
+from src.upload_scheduler import UploadScheduler
+
+
+STAND_IN_HOST = "127.0.0.1"
+STAND_IN_PORT = 18734
+REMOTE_HOSTS = ("https://7tv.io", "https://cdn.7tv.app", "https://cdn.discordapp.com")
+
+
+class StandInHttpClient(HttpClient):
+    """ Sends every request for a 7TV or discord host to the local stand-in server instead """
+    def __init__(self):
+        super().__init__(public_only=False) # the stand-in server is on loopback
+
+    def rewrite(self, url: str) -> str:
+        for remote_host in REMOTE_HOSTS:
+            if url.startswith(remote_host):
+                return f"http://{STAND_IN_HOST}:{STAND_IN_PORT}/{remote_host.removeprefix('https://')}{url.removeprefix(remote_host)}"
+        return url
+
+    async def get_json(self, url: str):
+        return await super().get_json(self.rewrite(url))
+
+    async def download_to(self, url: str, sink, max_bytes: int | None = None, probe=None):
+        return await super().download_to(self.rewrite(url), sink, max_bytes, probe)
+
+
+def build_stand_in_app(images: dict[str, bytes], latency_secs: float) -> web.Application:
+    """ Serves 7TV emote metadata, 7TV CDN files, and discord CDN emojis for every id in images """
+    async def emote_info(request: web.Request) -> web.Response:
+        await asyncio.sleep(latency_secs)
+        emote_id = request.match_info["emote_id"]
+        animated = int(emote_id) % 2 == 1
+        files = [{"name": f"{scale}x.webp", "format": "WEBP", "size": len(images[emote_id]) // (5 - scale)} for scale in range(1, 5)]
+        return web.json_response({
+            "id": emote_id,
+            "name": f"bench{emote_id}",
+            "animated": animated,
+            "host": {"url": f"//cdn.7tv.app/emote/{emote_id}", "files": files}
+        })
+
+    async def image_file(request: web.Request) -> web.Response:
+        await asyncio.sleep(latency_secs)
+        return web.Response(body=images[request.match_info["emote_id"]])
+
+    app = web.Application()
+    app.router.add_get("/7tv.io/v3/emotes/{emote_id}", emote_info)
+    app.router.add_get("/cdn.7tv.app/emote/{emote_id}/{file_name}", image_file)
+    app.router.add_get("/cdn.discordapp.com/emojis/{emote_id}.{ext}", image_file)
+    return app
+
+
+class FakeGuild:
+    """ Stand-in for discord's emoji endpoint - enforces the size limit and takes upload_latency_secs """
+    def __init__(self, guild_id: int, upload_latency_secs: float):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.emojis = []
+        self.emoji_limit = 1_000_000
+        self.upload_latency_secs = upload_latency_secs
+
+    async def create_custom_emoji(self, name: str, image: bytes):
+        await asyncio.sleep(self.upload_latency_secs)
+        if len(image) > MAX_EMOTE_SIZE_BYTES:
+            raise RuntimeError(f"{name}: {len(image)} bytes is over discord's limit")
+        emoji = SimpleNamespace(id=len(self.emojis), name=name, animated=image[:3] == b"GIF")
+        self.emojis.append(emoji)
+        return emoji
+
+
+class FakeMessage:
+    def __init__(self, content: str = ""):
+        self.content = content
+
+    async def edit(self, content: str) -> None:
+        self.content = content
+
+
+def make_ctx(bot, guild: FakeGuild, content: str, attachment_url: str = "", replied_message: FakeMessage | None = None):
+    """ Just enough of commands.Context for DiscordCtx and the Commands cog """
+    sent_messages = []
+
+    async def send(message: str) -> FakeMessage:
+        sent_messages.append(FakeMessage(message))
+        return sent_messages[-1]
+
+    async def fetch_message(message_id: int) -> FakeMessage:
+        return replied_message
+
+    message = SimpleNamespace(
+        content=content,
+        author=SimpleNamespace(guild_permissions=SimpleNamespace(manage_emojis=True)),
+        attachments=[SimpleNamespace(url=attachment_url)] if attachment_url else [],
+        embeds=[],
+        reference=SimpleNamespace(message_id=1, resolved=None, cached_message=replied_message) if replied_message else None,
+        channel=SimpleNamespace(fetch_message=fetch_message)
+    )
+    channel = SimpleNamespace(id=1, name="bench")
+    return SimpleNamespace(bot=bot, guild=guild, channel=channel, message=message, send=send, reply=send, sent_messages=sent_messages)
+
+
+async def run_command(cog: Commands, bot, kind: str, emote_id: str, guild: FakeGuild) -> tuple[float, bool]:
+    """ returns: (wall_secs, succeeded) """
+    if kind == "grab":
+        ctx = make_ctx(bot, guild, f"mote/grab https://7tv.app/emotes/{emote_id}")
+        call = Commands.grab.callback(cog, ctx, f"https://7tv.app/emotes/{emote_id}")
+    elif kind == "upload":
+        ctx = make_ctx(bot, guild, "mote/upload bench_upload", attachment_url=f"https://cdn.discordapp.com/emojis/{emote_id}.gif")
+        call = Commands.upload.callback(cog, ctx, "bench_upload")
+    else: # steal
+        animated_prefix = "a" if int(emote_id) % 2 else ""
+        replied_message = FakeMessage(f"look <{animated_prefix}:bench{emote_id}:{emote_id}>")
+        ctx = make_ctx(bot, guild, f"mote/steal bench{emote_id}", replied_message=replied_message)
+        call = Commands.steal.callback(cog, ctx, f"bench{emote_id}")
+    start_time = time.perf_counter()
+    await call
+    wall_secs = time.perf_counter() - start_time
+    return wall_secs, any("Success!" in message.content for message in ctx.sent_messages)
+
+
+async def run_benchmark(args) -> None:
+    rng = random.Random(0)
+    images = {}
+    for idx in range(args.distinct_emotes):
+        emote_id = str(1_000_000 + idx) # odd ids are animated
+        if idx % 2:
+            images[emote_id] = make_animated_gif((256, 256), 40, seed=idx)
+        else:
+            images[emote_id] = make_static_png((256, 256), seed=idx)
+
+    runner = web.AppRunner(build_stand_in_app(images, args.latency))
+    await runner.setup()
+    await web.TCPSite(runner, STAND_IN_HOST, STAND_IN_PORT).start()
+
+    bot = SimpleNamespace(
+        http_client=StandInHttpClient(),
+        image_pool=ImagePool(),
+        emote_cache=EmoteCache(cache_dir=""),
+        single_flight=SingleFlight(),
+        upload_scheduler=UploadScheduler(),
+        emoji_index=EmojiIndex(),
+        admission=AdmissionController() # unused, as the commands are called without their cog hooks
+    )
+    await bot.http_client.open()
+    bot.image_pool.start()
+    cog = Commands(bot)
+    # a guild per command, as the emoji index would turn away repeat uploads of the same emote to a guild
+    guilds = [FakeGuild(guild_id, args.latency) for guild_id in range(args.commands)]
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: dict[str, list[float]] = {"grab": [], "upload": [], "steal": []}
+    failures = 0
+
+    async def one_command(guild: FakeGuild) -> None:
+        nonlocal failures
+        kind = rng.choice(("grab", "upload", "steal"))
+        emote_id = rng.choice(list(images))
+        async with semaphore:
+            wall_secs, succeeded = await run_command(cog, bot, kind, emote_id, guild)
+        latencies[kind].append(wall_secs)
+        failures += not succeeded
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(one_command(guild) for guild in guilds))
+    total_secs = time.perf_counter() - start_time
+
+    print(f"{args.commands} commands, concurrency {args.concurrency}, {args.distinct_emotes} distinct emotes: "
+          f"{total_secs:.2f}s ({args.commands / total_secs:.1f} commands/s, {failures} failed)")
+    for kind, values in latencies.items():
+        if values:
+            p95 = statistics.quantiles(values, n=20)[-1] if len(values) > 1 else values[0]
+            print(f"  {kind:<7} n={len(values):<4} median={statistics.median(values):.3f}s p95={p95:.3f}s")
+    print(f"  uploads: {sum(len(guild.emojis) for guild in guilds)}, cache: {bot.emote_cache}, coalesced calls: {bot.single_flight.shared_calls}")
+
+    await bot.http_client.close()
+    bot.image_pool.shutdown()
+    await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--commands", type=int, default=60)
+    parser.add_argument("--distinct-emotes", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated latency of each remote call, in seconds")
+    args = parser.parse_args()
+    logging.getLogger("bot").setLevel(logging.WARNING) # keep the per-message logs out of the results
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
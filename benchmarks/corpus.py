@@ -0,0 +1,54 @@
+""" Synthetic, deterministic inputs shaped like the images the bot actually sees """
+import math
+import random
+from io import BytesIO
+from PIL import Image, ImageDraw
+
+
+def make_frame(size: tuple[int, int], frame_idx: int, rng: random.Random) -> Image.Image:
+    """ A transparent frame with moving shapes and a gradient, so it compresses like a real emote (not like noise) """
+    width, height = size
+    frame = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(frame)
+    for ring in range(0, min(width, height) // 2, max(2, width // 32)):
+        hue = (ring * 5 + frame_idx * 7) % 255
+        draw.ellipse((ring, ring, width - ring - 1, height - ring - 1), outline=(hue, 255 - hue, (hue * 3) % 255, 255), width=2)
+    offset = int((math.sin(frame_idx / 5) + 1) * width / 4)
+    draw.rectangle((offset, height // 3, offset + width // 4, height // 3 + height // 4), fill=(rng.randrange(256), rng.randrange(256), 40, 255))
+    return frame
+
+
+def make_static_png(size: tuple[int, int], seed: int = 0) -> bytes:
+    output = BytesIO()
+    make_frame(size, 0, random.Random(seed)).save(output, format="PNG")
+    return output.getvalue()
+
+
+def make_animated_gif(size: tuple[int, int], num_frames: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    frames = [make_frame(size, idx, rng) for idx in range(num_frames)]
+    output = BytesIO()
+    frames[0].save(output, format="GIF", save_all=True, append_images=frames[1:], duration=40, loop=0, disposal=2)
+    return output.getvalue()
+
+
+def make_webp_derived_gif(size: tuple[int, int], num_frames: int, seed: int = 0) -> bytes:
+    """ What 7TV's CDN serves for a 4x emote - an animated WEBP transcoded to GIF """
+    rng = random.Random(seed)
+    frames = [make_frame(size, idx, rng) for idx in range(num_frames)]
+    webp = BytesIO()
+    frames[0].save(webp, format="WEBP", save_all=True, append_images=frames[1:], duration=40, loop=0, quality=80)
+    output = BytesIO()
+    decoded = Image.open(BytesIO(webp.getvalue()))
+    decoded.save(output, format="GIF", save_all=True, loop=0, disposal=2)
+    return output.getvalue()
+
+
+def build_corpus() -> dict[str, bytes]:
+    return {
+        "small_png_64": make_static_png((64, 64)),
+        "large_png_512": make_static_png((512, 512)),
+        "webp_4x_gif_60f": make_webp_derived_gif((384, 384), 60),
+        "webp_4x_gif_wide_40f": make_webp_derived_gif((512, 256), 40, seed=1),
+        "gif_300f": make_animated_gif((128, 128), 300, seed=2),
+    }
@@ -1,87 +1,265 @@
+import time
+STARTED_AT = time.perf_counter() # for the startup timeline, so taken before the heavier imports below
+
 import asyncio
-from discord import Intents
+import multiprocessing
+import pkgutil
+import aiohttp
+import discord
+from discord import Intents, MemberCacheFlags
 from discord.ext import commands
 from src.globals import (
     DEBUG_MODE,
     BOT_TOKEN,
     BOT_TEST_TOKEN,
     BOT_PREFIX,
-    COGS_PATH
+    COGS_PATH,
+    MAX_RATELIMIT_TIMEOUT_SECS,
+    METRICS_HOST,
+    METRICS_PORT,
+    JOB_MAX_ATTEMPTS,
+    JOB_MAX_AGE_SECS,
+    SHARD_COUNT,
+    SHARD_PROCESSES,
+    SHARD_PROCESS_INDEX
 )
+from src.http_client import HttpClient
+from src.image_pool import ImagePool
+from src.emote_cache import EmoteCache
+from src.single_flight import SingleFlight
+from src.upload_scheduler import UploadScheduler
+from src.embed_waiter import EmbedWaiter
+from src.emoji_index import EmojiIndex
+from src.admission import AdmissionController
+from src.job_queue import Job, JobQueue
+from src.logs import ExecutionOutcome
+from src.helpers import emojify_str
+from src.metrics import metrics, MetricsServer
 import sys
 import os
 import textwrap
 
 
 class MyHelpCommand(commands.DefaultHelpCommand):
+    """ Sends the help texts MyBot.render_help_texts built when the cogs were loaded """
     def __init__(self):
         super().__init__()
 
     async def send_bot_help(self, mapping) -> None:
-        help_msg = "List of commands:\n\n"
-        for cog in mapping:
-            for command in mapping[cog]:
-                help_msg += f"`{command.name}` - {command.help}\n"
-        help_msg += "\nUse `mote/help <command_name>` to see how to use a specific command."
-        await self.get_destination().send(help_msg)
+        await self.get_destination().send(self.context.bot.bot_help_text)
     
     async def send_command_help(self, command) -> None:
-        if command.name == "help":
-            help_msg = f"Use `{BOT_PREFIX}help` to show all commands."
-        else:
-            help_msg = textwrap.dedent(f"""
-                {command.help}
-                Usage: `{command.usage}`
-                (`<>` = *required* parameters, `[]` = *optional* parameters)
-            """)
+        help_msg = self.context.bot.command_help_texts.get(command.qualified_name) or render_command_help(command)
         await self.get_destination().send(help_msg)
 
 
-class MyBot(commands.Bot):
-    def __init__(self, command_prefix, description, intents, help_command):
+def render_command_help(command: commands.Command) -> str:
+    if command.name == "help":
+        return f"Use `{BOT_PREFIX}help` to show all commands."
+    return textwrap.dedent(f"""
+        {command.help}
+        Usage: `{command.usage}`
+        (`<>` = *required* parameters, `[]` = *optional* parameters)
+    """)
+
+
+class MyBot(commands.AutoShardedBot):
+    def __init__(self, command_prefix, description, intents, help_command, shard_count=None, shard_ids=None):
+        self.upload_scheduler = UploadScheduler() # needed by super().__init__, to see emoji rate-limit headers
         super().__init__(
             command_prefix=command_prefix,
             description=description,
             intents=intents,
             help_command=help_command,
-            case_insensitive=True
+            shard_count=shard_count, # None - discord's recommended count, with every shard run by this process
+            shard_ids=shard_ids,
+            member_cache_flags=MemberCacheFlags.none(),
+            chunk_guilds_at_startup=False,
+            case_insensitive=True,
+            http_trace=self.upload_scheduler.trace_config,
+            max_ratelimit_timeout=MAX_RATELIMIT_TIMEOUT_SECS # longer waits are left to the upload scheduler
         )
+        self.http_client = HttpClient()
+        self.image_pool = ImagePool()
+        self.emote_cache = EmoteCache()
+        self.single_flight = SingleFlight()
+        self.embed_waiter = EmbedWaiter()
+        self.emoji_index = EmojiIndex()
+        self.admission = AdmissionController()
+        self.job_queue = JobQueue()
+        metrics_port = METRICS_PORT + SHARD_PROCESS_INDEX # one endpoint per shard process
+        self.metrics_server = MetricsServer(metrics, METRICS_HOST, metrics_port) if METRICS_PORT else None
+        self.loop_lag_task: asyncio.Task | None = None
+        self.resume_task: asyncio.Task | None = None
+        self.shutting_down = False
+        self.bot_help_text = ""
+        self.command_help_texts: dict[str, str] = {} # command name -> its help text
 
     async def on_ready(self):
-        print(f"Logged in as {self.user}.")
+        if "ready" not in metrics.startup_secs: # on_ready also fires after reconnects
+            metrics.mark_startup("ready", STARTED_AT)
+            timeline = ", ".join(f"{milestone} {secs:.2f}s" for milestone, secs in metrics.startup_secs.items())
+            print(f"Startup timeline: {timeline}")
+        print(f"Logged in as {self.user}, running shards {sorted(self.shards)} of {self.shard_count}.")
+
+    async def on_raw_message_edit(self, payload):
+        self.embed_waiter.on_raw_message_edit(payload)
+
+    async def on_guild_emojis_update(self, guild, before, after):
+        self.emoji_index.on_guild_emojis_update(guild, after)
+
+    async def on_guild_remove(self, guild):
+        self.emoji_index.on_guild_remove(guild)
 
     async def load_cogs(self):
-        sys.path.insert(0, COGS_PATH)
-        for file in os.listdir(COGS_PATH):
-            if file.endswith(".py"):
-                extension_name = file[:-3]
-                try:
-                    await self.load_extension(extension_name)
-                except commands.ExtensionError as e:
-                    sys.exit(f"Error loading extension: {e}")
-                except Exception as f:
-                    sys.exit(str(f))
-                else:
-                    print(f"{self.description}: {extension_name} loaded")
-        sys.path.pop(0)
+        """ Loads every module in src/cogs as an extension, concurrently """
+        extension_names = [f"src.cogs.{module.name}" for module in pkgutil.iter_modules([COGS_PATH])]
+        results = await asyncio.gather(*(self.load_extension(name) for name in extension_names), return_exceptions=True)
+        for extension_name, result in zip(extension_names, results):
+            if isinstance(result, commands.ExtensionError):
+                sys.exit(f"Error loading extension: {result}")
+            elif isinstance(result, Exception):
+                sys.exit(str(result))
+            print(f"{self.description}: {extension_name} loaded")
+        self.render_help_texts()
+
+    def render_help_texts(self) -> None:
+        """ The help texts only change when commands do, so they're built once here rather than on every help call """
+        bot_commands = [command for cog in self.cogs.values() for command in cog.get_commands()]
+        bot_commands += [command for command in self.commands if command.cog is None]
+        command_lines = "".join(f"`{command.name}` - {command.help}\n" for command in bot_commands)
+        self.bot_help_text = f"List of commands:\n\n{command_lines}\nUse `mote/help <command_name>` to see how to use a specific command."
+        self.command_help_texts = {command.qualified_name: render_command_help(command) for command in self.walk_commands()}
 
     async def setup_hook(self):
-        """ Runs when the bot first starts up """
+        """ Runs when the bot first starts up. The HTTP session, image workers and Pillow are all left until first needed """
+        metrics.mark_startup("setup_hook", STARTED_AT)
+        self.image_pool.start() # workers are only spawned as jobs arrive
+        metrics.add_gauge("image_pool_pending_jobs", lambda: self.image_pool.pending)
+        metrics.add_gauge("upload_queue_waiting", lambda: self.upload_scheduler.total_waiting)
+        metrics.add_gauge("commands_running", lambda: self.admission.running)
+        metrics.add_gauge("commands_waiting", lambda: self.admission.waiting)
+        self.loop_lag_task = asyncio.create_task(metrics.monitor_loop_lag())
+        if self.metrics_server:
+            await self.metrics_server.start()
         await self.load_cogs()
+        metrics.mark_startup("cogs_loaded", STARTED_AT)
+        await self.job_queue.open()
+        metrics.add_gauge("job_queue_unfinished", lambda: self.job_queue.size)
+        self.resume_task = asyncio.create_task(self.resume_jobs())
+
+    async def resume_jobs(self):
+        """ Runs again the commands that a restart or crash cut off, once the guild cache is ready """
+        await self.wait_until_ready()
+        resumed_ctxs = []
+        for job in await self.job_queue.unfinished():
+            guild = self.get_guild(job.guild_id)
+            if not guild: # another shard process's guild, or the bot has since left it
+                continue
+            try:
+                ctx = await self.get_job_context(guild, job)
+            except discord.HTTPException as e: # eg the command message was deleted
+                print(f"Could not resume job {job.job_id}: {e}", file=sys.stderr)
+                await self.job_queue.finish(job.job_id)
+                continue
+            if ctx:
+                await self.job_queue.record_attempt(job.job_id)
+                resumed_ctxs.append(ctx)
+        # admission control queues these alongside new commands
+        await asyncio.gather(*(self.invoke(ctx) for ctx in resumed_ctxs))
+
+    async def get_job_context(self, guild: discord.Guild, job: Job) -> commands.Context | None:
+        """ Rebuilds the job's command context, or returns None (and drops the job) if it's not worth resuming """
+        channel = guild.get_channel_or_thread(job.channel_id)
+        if not channel:
+            await self.job_queue.finish(job.job_id)
+            return None
+        status_message = channel.get_partial_message(job.status_message_id) if job.status_message_id else None
+        if job.attempts >= JOB_MAX_ATTEMPTS or time.time() - job.created_at > JOB_MAX_AGE_SECS:
+            await self.job_queue.finish(job.job_id)
+            if status_message:
+                await status_message.edit(content=emojify_str("Interrupted by a restart, please try again.", ExecutionOutcome.ERROR))
+            return None
+        message = await channel.fetch_message(job.message_id)
+        message.author = await guild.fetch_member(message.author.id) # fetched messages only have a User, without guild permissions
+        ctx = await self.get_context(message)
+        ctx.job_id = job.job_id
+        ctx.status_message = status_message
+        return ctx
+
+    async def close(self):
+        self.shutting_down = True # set first, so commands cut off from here on keep their jobs
+        await self.http_client.close()
+        self.image_pool.shutdown()
+        if self.loop_lag_task:
+            self.loop_lag_task.cancel()
+        if self.resume_task:
+            self.resume_task.cancel()
+        await self.job_queue.close()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        await super().close()
 
 
-async def main():
-    token = BOT_TOKEN if DEBUG_MODE == "False" else BOT_TEST_TOKEN
+def get_intents() -> Intents:
+    """ Only what the Commands cog uses - no presence, member or typing events """
+    intents = Intents.none()
+    intents.guilds = True
+    intents.messages = True
+    intents.message_content = True
+    intents.emojis_and_stickers = True
+    return intents
+
+
+def get_token() -> str:
+    return BOT_TOKEN if DEBUG_MODE == "False" else BOT_TEST_TOKEN
+
+
+async def main(shard_count: int | None = None, shard_ids: list[int] | None = None):
+    metrics.mark_startup("imports", STARTED_AT)
     prefixes = [BOT_PREFIX, BOT_PREFIX.title()] # both lowercase and title case are options
     bot = MyBot(
         command_prefix=commands.when_mentioned_or(*prefixes),
         description="Mote Bot",
-        intents=Intents.all(),
-        help_command=MyHelpCommand()
+        intents=get_intents(),
+        help_command=MyHelpCommand(),
+        shard_count=shard_count,
+        shard_ids=shard_ids
     )
-    await bot.start(token)
+    async with bot: # ensures bot.close() runs (and the HTTP session is closed) on shutdown
+        await bot.start(get_token())
+
+
+async def fetch_recommended_shard_count(token: str) -> int:
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {token}"}) as response:
+            response.raise_for_status()
+            return (await response.json())["shards"]
+
+
+def run_shard_process(shard_count: int, shard_ids: list[int]) -> None:
+    asyncio.run(main(shard_count, shard_ids))
+
+
+def run_shard_processes() -> None:
+    """ Splits the shards into contiguous ranges, one per process """
+    shard_count = SHARD_COUNT or asyncio.run(fetch_recommended_shard_count(get_token()))
+    num_processes = min(SHARD_PROCESSES, shard_count)
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for process_idx in range(num_processes):
+        shard_ids = list(range(process_idx * shard_count // num_processes, (process_idx + 1) * shard_count // num_processes))
+        os.environ["SHARD_PROCESS_INDEX"] = str(process_idx) # inherited by the spawned process, read by src.globals
+        process = context.Process(target=run_shard_process, args=(shard_count, shard_ids), name=f"shards-{shard_ids[0]}-{shard_ids[-1]}")
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
 
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
\ No newline at end of file
+    if SHARD_PROCESSES > 1:
+        run_shard_processes()
+    else:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(main(SHARD_COUNT or None))
\ No newline at end of file
@@ -0,0 +1,93 @@
+import asyncio
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+from discord.ext import commands
+from src.globals import COMMAND_MAX_RUNNING, COMMAND_MAX_WAITING
+
+
+# commands opt in with extras={"lane": ...} - lower runs first, and commands without a lane are never held back
+LANE_PRIORITIES = {"image": 0, "batch": 1}
+
+
+class CommandBusyError(commands.CommandError):
+    """ Raised (from Commands.cog_before_invoke) when a command is turned away rather than queued """
+    def __init__(self, retry_after: float):
+        super().__init__(f"Busy, retry in {retry_after:.0f}s.")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Lets at most max_running image commands run at once, queueing up to max_waiting more by lane priority.
+    Anything beyond that is turned away straight away with an estimate of when to retry.
+    """
+    def __init__(self, max_running: int = COMMAND_MAX_RUNNING, max_waiting: int = COMMAND_MAX_WAITING):
+        self.max_running = max_running
+        self.max_waiting = max_waiting
+        self.running = 0
+        self.waiters: list[tuple[int, int, asyncio.Future]] = [] # heap of (priority, arrival order, future)
+        self.arrivals = itertools.count()
+        self.avg_run_secs = 5.0
+
+    @property
+    def waiting(self) -> int:
+        return len(self.waiters)
+
+    @property
+    def retry_after(self) -> float:
+        """ Roughly how long until a new command would get to run """
+        return max(1.0, self.avg_run_secs * (self.waiting + 1) / self.max_running)
+
+    async def acquire(self, lane: str, readmit: bool = False) -> None:
+        """ Raises CommandBusyError if the queue is full, unless readmit (for commands taking back a slot they gave up) """
+        if self.running < self.max_running and not self.waiters:
+            self.running += 1
+            return
+        if self.waiting >= self.max_waiting and not readmit:
+            raise CommandBusyError(self.retry_after)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (LANE_PRIORITIES[lane], next(self.arrivals), future))
+        try:
+            await future # release() hands over its slot, so running is already counted
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled(): # the slot was handed over just as we were cancelled
+                self.release()
+            else:
+                self.waiters = [waiter for waiter in self.waiters if waiter[2] is not future]
+                heapq.heapify(self.waiters)
+            raise
+
+    @asynccontextmanager
+    async def suspended(self, ctx, resume: bool = True):
+        """
+        Gives up the command's slot while it only waits (eg on its guild's upload queue or emoji rate limit),
+        so one guild's rate limit can't hold up every other guild's commands.
+        With resume, the slot is taken back once the command's last suspension ends.
+        Does nothing for commands that weren't admitted by Commands.cog_before_invoke.
+        """
+        lane = getattr(ctx, "lane", None)
+        if not lane:
+            yield
+            return
+        ctx.suspensions += 1 # a batch command's concurrent uploads share its one slot
+        if ctx.admitted:
+            ctx.admitted = False
+            self.release()
+        try:
+            yield
+        finally:
+            ctx.suspensions -= 1
+            if resume and not ctx.suspensions and not ctx.admitted:
+                await self.acquire(lane, readmit=True)
+                ctx.admitted = True
+
+    def release(self, run_secs: float | None = None) -> None:
+        if run_secs is not None:
+            self.avg_run_secs = 0.8 * self.avg_run_secs + 0.2 * run_secs
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None) # hand the slot straight over
+                return
+        self.running -= 1
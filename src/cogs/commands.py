@@ -1,25 +1,93 @@
 from discord.ext import commands
 import asyncio
+import math
 import re
+import sys
+import time
+import traceback
 from src.logs import ExecutionOutcome
-from src.globals import BOT_INVITE_LINK, BOT_PREFIX
+from src.globals import (
+    BOT_INVITE_LINK,
+    BOT_PREFIX,
+    BATCH_MAX_EMOTES,
+    BATCH_CONCURRENCY,
+    USER_COMMAND_RATE,
+    USER_COMMAND_PER_SECS,
+    GUILD_COMMAND_RATE,
+    GUILD_COMMAND_PER_SECS
+)
 from src.helpers import (
     DiscordCtx,
+    BatchUpload,
     is_valid_7tv_url,
+    is_valid_7tv_set_url,
     get_7tv_api_url,
-    retrieve_7tv_image_info,
-    download_7tv_image,
-    download_discord_img,
-    convert_discord_img,
-    resize_img
+    retrieve_7tv_emote_set,
+    get_7tv_emote,
+    get_7tv_emote_image,
+    download_discord_img
 )
+from src.image_pool import ImagePoolBusyError
+from src.workspace import ImageWorkspace
+from src.metrics import metrics
+from src.admission import CommandBusyError
 
 
 class Commands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # both apply to every command with a lane (see src/admission.py)
+        self.user_cooldowns = commands.CooldownMapping.from_cooldown(USER_COMMAND_RATE, USER_COMMAND_PER_SECS, commands.BucketType.user)
+        self.guild_cooldowns = commands.CooldownMapping.from_cooldown(GUILD_COMMAND_RATE, GUILD_COMMAND_PER_SECS, commands.BucketType.guild)
+
+    async def cog_before_invoke(self, ctx) -> None:
+        """
+        Admission control for image commands - raises CommandOnCooldown or CommandBusyError to turn them away.
+        Resumable commands are recorded in the job queue until they finish (resumed ones already have a job_id).
+        """
+        ctx.admitted = False
+        ctx.suspensions = 0 # see AdmissionController.suspended
+        lane = ctx.command.extras.get("lane")
+        resumed = getattr(ctx, "job_id", None) is not None
+        if lane:
+            for cooldowns in (self.user_cooldowns, self.guild_cooldowns):
+                bucket = cooldowns.get_bucket(ctx.message)
+                retry_after = bucket.update_rate_limit()
+                if retry_after and not resumed:
+                    raise commands.CommandOnCooldown(bucket, retry_after, cooldowns.type)
+            if ctx.command.extras.get("resumable") and not resumed:
+                ctx.job_id = await self.bot.job_queue.enqueue(ctx) # before waiting for admission, so queued commands survive restarts too
+            try:
+                await self.bot.admission.acquire(lane)
+            except CommandBusyError:
+                await self.finish_job(ctx)
+                raise
+            ctx.admitted = True
+            ctx.lane = lane
+        ctx.start_time = time.perf_counter()
+
+    async def cog_after_invoke(self, ctx) -> None:
+        run_secs = time.perf_counter() - ctx.start_time
+        if ctx.admitted:
+            self.bot.admission.release(run_secs)
+        if not self.bot.shutting_down: # likely cut off by the shutdown - leave the job to be resumed
+            await self.finish_job(ctx)
+        metrics.observe_stage(f"command_{ctx.command.name}", run_secs)
+
+    async def finish_job(self, ctx) -> None:
+        job_id = getattr(ctx, "job_id", None)
+        if job_id is not None:
+            ctx.job_id = None
+            await self.bot.job_queue.finish(job_id)
+
+    async def cog_command_error(self, ctx, error) -> None:
+        if isinstance(error, (commands.CommandOnCooldown, CommandBusyError)):
+            return await DiscordCtx(ctx).reply_to_user(f"Busy, please retry in {math.ceil(error.retry_after)}s.", ExecutionOutcome.WARNING)
+        # defining this handler silences discord.py's default error output, so print the same
+        print(f"Ignoring exception in command {ctx.command}:", file=sys.stderr)
+        traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
 
-    @commands.command(help="Grab an emote from 7TV and upload to the server.", usage=f"{BOT_PREFIX}grab <7tv_url> [emote_name]")
+    @commands.command(help="Grab an emote from 7TV and upload to the server.", usage=f"{BOT_PREFIX}grab <7tv_url> [emote_name]", extras={"lane": "image", "resumable": True})
     async def grab(self, ctx, page_url: str, emote_name: str|None = None) -> None:
         contxt = DiscordCtx(ctx)
         if not contxt.has_emoji_perms:
@@ -35,7 +103,7 @@ class Commands(commands.Cog):
         await contxt.send_msg("Working on it...", add_loading_icon=True)
 
         api_url = get_7tv_api_url(page_url)
-        emote, err = retrieve_7tv_image_info(api_url, emote_name)
+        emote, err = await get_7tv_emote(self.bot, api_url, emote_name)
         if not emote:
             return await(contxt.edit_msg(err, ExecutionOutcome.ERROR))
         
@@ -44,34 +112,70 @@ class Commands(commands.Cog):
         if not emote.dl_urls: # failsafe
             return await(contxt.edit_msg("No valid download URLs found.", ExecutionOutcome.ERROR))
 
-        # try to download from urls/upload to the server until one works
-        num_attempts = len(emote.dl_urls)
-        for attempt_num, url in enumerate(emote.dl_urls, 1):
-            img_path, err = download_7tv_image(url, emote.format)
-            if not img_path:
-                # assume that the rest of the urls won't be downloadable either
-                return await(contxt.edit_msg(err, ExecutionOutcome.ERROR))
-            err_text, err_code = await contxt.upload_emoji_to_server(emote.name, img_path)
-            if not err_text: # successful upload
-                break
-            elif err_code == 50138: # if image too large to upload
-                if attempt_num < num_attempts:
-                    await contxt.edit_msg(f"Trying to upload a new size... ({attempt_num}/{num_attempts-1})", add_loading_icon=True)
-                else: # if the final attempt fails, try to manually resize
-                    await contxt.edit_msg("Trying to manually resize...", add_loading_icon=True)
-                    img_path, resize_err = resize_img(img_path)
-                    if resize_err:
-                        return await(contxt.edit_msg(resize_err, ExecutionOutcome.ERROR))
-                    err_text, err_code = await contxt.upload_emoji_to_server(emote.name, img_path)
-                    if err_code:
-                        return await(contxt.edit_msg(err_text, ExecutionOutcome.ERROR))
-            else: # any other error
-                return await(contxt.edit_msg(err_text, ExecutionOutcome.ERROR))
+        try:
+            img_content, err = await get_7tv_emote_image(contxt, emote)
+        except ImagePoolBusyError as e:
+            return await contxt.edit_msg(str(e), ExecutionOutcome.WARNING)
+        if err:
+            return await(contxt.edit_msg(err, ExecutionOutcome.ERROR))
+        err_text, _ = await contxt.upload_emoji_to_server(emote.name, img_content)
+        if err_text:
+            return await(contxt.edit_msg(err_text, ExecutionOutcome.ERROR))
 
         return await contxt.edit_msg(f"Success! `{emote.name}` uploaded!", ExecutionOutcome.SUCCESS)
 
 
-    @commands.command(help="Retrieve an image from a link/attachment, and upload to the server.", usage=f"{BOT_PREFIX}upload <link/attachment> <emote_name>")
+    @commands.command(
+        help="Grab several emotes (or a whole emote set) from 7TV and upload them to the server.",
+        usage=f"{BOT_PREFIX}grabmany <7tv_url> [7tv_url ...] OR {BOT_PREFIX}grabmany <7tv_emote_set_url>",
+        extras={"lane": "batch"}
+    )
+    async def grabmany(self, ctx, *page_urls: str) -> None:
+        contxt = DiscordCtx(ctx)
+        if not contxt.has_emoji_perms:
+            return await contxt.reply_to_user("You do not have sufficient permissions to use this command.", ExecutionOutcome.WARNING)
+        if not page_urls:
+            return await contxt.reply_to_user(f"Usage: `{BOT_PREFIX}grabmany <7tv_url> [7tv_url ...]` or `{BOT_PREFIX}grabmany <7tv_emote_set_url>`", ExecutionOutcome.WARNING)
+
+        if len(page_urls) == 1 and is_valid_7tv_set_url(page_urls[0]):
+            requested_emotes, err = await retrieve_7tv_emote_set(self.bot.http_client, page_urls[0])
+            if err:
+                return await contxt.reply_to_user(err, ExecutionOutcome.ERROR)
+        else:
+            invalid_urls = [url for url in page_urls if not is_valid_7tv_url(url)]
+            if invalid_urls:
+                return await contxt.reply_to_user(f"Please provide valid 7TV URLs. Invalid: {', '.join(invalid_urls[:5])}", ExecutionOutcome.WARNING)
+            requested_emotes = [(get_7tv_api_url(url), None) for url in dict.fromkeys(page_urls)] # dedupe, keeping order
+        # eg most of a large emote set - the first BATCH_MAX_EMOTES are grabbed, and the rest listed in the summary
+        skipped = [emote_name or api_url.split("/")[-1] for api_url, emote_name in requested_emotes[BATCH_MAX_EMOTES:]]
+        requested_emotes = requested_emotes[:BATCH_MAX_EMOTES]
+
+        await contxt.send_msg(f"Grabbing {len(requested_emotes)} emotes...", add_loading_icon=True)
+        batch = BatchUpload(contxt, len(requested_emotes), "Grabbing", skipped)
+        fetch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def grab_one(api_url: str, suggested_emote_name: str | None) -> None:
+            emote_label = suggested_emote_name or api_url.split("/")[-1]
+            async with fetch_semaphore:
+                emote, err = await get_7tv_emote(self.bot, api_url, suggested_emote_name)
+                if emote:
+                    emote_label = emote.name
+                    try:
+                        img_content, err = await get_7tv_emote_image(contxt, emote)
+                    except ImagePoolBusyError as e:
+                        err = str(e)
+            if not err:
+                err = await batch.upload(emote.name, img_content)
+            await batch.add_result(emote_label, err)
+
+        await asyncio.gather(*(grab_one(api_url, emote_name) for api_url, emote_name in requested_emotes))
+        await batch.finish()
+
+    @commands.command(
+        help="Retrieve an image from a link/attachment, and upload to the server.",
+        usage=f"{BOT_PREFIX}upload <link/attachment> <emote_name>",
+        extras={"lane": "image", "resumable": True}
+    )
     async def upload(self, ctx, *args) -> None:        
         # if uploading an attachment: args = [emote_name]
         # if providing an image link: args = [image_url, emote_name]
@@ -86,39 +190,46 @@ class Commands(commands.Cog):
             img_url = contxt.attachments[0].url
             emote_name = args[0]
         else:
-            await asyncio.sleep(0.2) # hacky way to wait for the embed to load
-            if ctx.message.embeds:
-                if len(args) < 2: # args = [emote_name, image_link]
-                    return await contxt.reply_to_user(f"Usage: `{BOT_PREFIX}upload <link/attachment> <emote_name>`", ExecutionOutcome.WARNING)
-                emote_name = args[1]
-                for embed in ctx.message.embeds:
-                    if embed.type == "image":
+            img_url = args[0].strip("<>") # <link> suppresses the embed
+            if not img_url.startswith(("https://", "http://")):
+                return await contxt.reply_to_user("You must attach an image or provide a link to an image.", ExecutionOutcome.WARNING)
+            if len(args) < 2: # args = [image_link, emote_name]
+                return await contxt.reply_to_user(f"Usage: `{BOT_PREFIX}upload <link/attachment> <emote_name>`", ExecutionOutcome.WARNING)
+            emote_name = args[1]
+            if img_url == args[0]:
+                # an image embed points straight at the image, even if the link was to a page containing it
+                for embed in await self.bot.embed_waiter.wait_for_embeds(ctx.message):
+                    if embed.type == "image" and embed.url:
                         img_url = embed.url
                         break
-                else:
-                    return await contxt.reply_to_user("An image could not be found from the URL provided.", ExecutionOutcome.WARNING)
-            else:
-                return await contxt.reply_to_user("You must attach an image or provide a link to an image.", ExecutionOutcome.WARNING)
-                
+            # otherwise the link itself is downloaded, and rejected as soon as its first bytes show it isn't an image
+
         if not emote_name.replace("_","").isalnum() or len(emote_name) < 2 or len(emote_name) > 32: # only alphanums or underscores allowed in names
             return await contxt.reply_to_user("Emote name must be between 2 and 32 alphanumeric characters long.", ExecutionOutcome.WARNING)
 
         await contxt.send_msg("Working on it...", add_loading_icon=True)
 
-        img_path, img_size, error = download_discord_img(img_url)
-        if error:
-            return await contxt.edit_msg(error, ExecutionOutcome.ERROR)
-        resized_img_path, error = convert_discord_img(img_path, img_size)
-        if error:
-            return await contxt.edit_msg(error, ExecutionOutcome.ERROR)
-        err_text, _ = await contxt.upload_emoji_to_server(emote_name, resized_img_path)
+        with ImageWorkspace() as workspace:
+            img_header, error = await download_discord_img(self.bot.http_client, img_url, workspace)
+            if error:
+                return await contxt.edit_msg(error, ExecutionOutcome.ERROR)
+            if not img_header.fits_as_is(workspace.size): # otherwise it can skip the image pool
+                from src.imaging import convert_discord_img # deferred, so Pillow isn't loaded at startup
+                try:
+                    error = await contxt.convert_in_workspace(convert_discord_img, workspace)
+                except ImagePoolBusyError as e:
+                    return await contxt.edit_msg(str(e), ExecutionOutcome.WARNING)
+                if error:
+                    return await contxt.edit_msg(error, ExecutionOutcome.ERROR)
+            err_text, _ = await contxt.upload_emoji_to_server(emote_name, workspace.read())
         if err_text:
             return await contxt.edit_msg(err_text, ExecutionOutcome.ERROR)
         return await contxt.edit_msg(f"Success! `{emote_name}` uploaded!", ExecutionOutcome.SUCCESS)
 
     @commands.command(
         help="'Steal' an emote from a discord message, by *replying* to it with the name of the emote.",
-        usage=f"{BOT_PREFIX}steal <selected_emote> [*new_name]"
+        usage=f"{BOT_PREFIX}steal <selected_emote> [*new_name]",
+        extras={"lane": "image", "resumable": True}
     )
     async def steal(self, ctx, selected_emote: str = "", given_emote_name: str = "") -> None:
         contxt = DiscordCtx(ctx)
@@ -151,17 +262,85 @@ class Commands(commands.Cog):
             return await contxt.edit_msg(f"No emote called {selected_emote} could be found in that message.", ExecutionOutcome.WARNING)
         
         emote_name = og_emote_name if not given_emote_name else new_emote_name
-        img_path, img_size, error = download_discord_img(img_url)
-        if error:
-            return await contxt.edit_msg(error, ExecutionOutcome.ERROR)
-        resized_img_path, error = convert_discord_img(img_path, img_size)
-        if error:
-            return await contxt.edit_msg(error, ExecutionOutcome.ERROR)
-        err_text, _ = await contxt.upload_emoji_to_server(emote_name, resized_img_path)
+        with ImageWorkspace() as workspace:
+            img_header, error = await download_discord_img(self.bot.http_client, img_url, workspace)
+            if error:
+                return await contxt.edit_msg(error, ExecutionOutcome.ERROR)
+            if not img_header.fits_as_is(workspace.size): # otherwise it can skip the image pool
+                from src.imaging import convert_discord_img
+                try:
+                    error = await contxt.convert_in_workspace(convert_discord_img, workspace)
+                except ImagePoolBusyError as e:
+                    return await contxt.edit_msg(str(e), ExecutionOutcome.WARNING)
+                if error:
+                    return await contxt.edit_msg(error, ExecutionOutcome.ERROR)
+            err_text, _ = await contxt.upload_emoji_to_server(emote_name, workspace.read())
         if err_text:
             return await contxt.edit_msg(err_text, ExecutionOutcome.ERROR)
         return await contxt.edit_msg(f"Success! `{emote_name}` uploaded!", ExecutionOutcome.SUCCESS)
 
+    @commands.command(
+        help="'Steal' every emote from a discord message (or just the ones named), by *replying* to it.",
+        usage=f"{BOT_PREFIX}stealmany [emote_name ...]",
+        extras={"lane": "batch"}
+    )
+    async def stealmany(self, ctx, *selected_emotes: str) -> None:
+        contxt = DiscordCtx(ctx)
+        if not contxt.has_emoji_perms:
+            return await contxt.reply_to_user("You do not have sufficient permissions to use this command.", ExecutionOutcome.WARNING)
+        replied_message = await contxt.get_replied_message(with_reactions=True)
+        if not replied_message:
+            return await contxt.reply_to_user("You must reply to a message to yoink its emotes.", ExecutionOutcome.WARNING)
+
+        requested_emotes = contxt.get_all_emote_info_from_message(replied_message)
+        if selected_emotes:
+            # strip extra chars in case they copy and pasted emotes directly
+            selected_names = {re.sub(r"^<a?:(\w+):\d+>$", r"\1", emote).strip(":").lower() for emote in selected_emotes}
+            requested_emotes = [(img_url, emote_name) for img_url, emote_name in requested_emotes if emote_name.lower() in selected_names]
+        if not requested_emotes:
+            return await contxt.reply_to_user("No custom emotes could be found in that message.", ExecutionOutcome.WARNING)
+        skipped = [emote_name for _, emote_name in requested_emotes[BATCH_MAX_EMOTES:]]
+        requested_emotes = requested_emotes[:BATCH_MAX_EMOTES]
+
+        await contxt.send_msg(f"Stealing {len(requested_emotes)} emotes...", add_loading_icon=True)
+        batch = BatchUpload(contxt, len(requested_emotes), "Stealing", skipped)
+        fetch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def steal_one(img_url: str, emote_name: str) -> None:
+            async with fetch_semaphore:
+                with ImageWorkspace() as workspace:
+                    img_header, err = await download_discord_img(self.bot.http_client, img_url, workspace)
+                    img_content = workspace.read()
+                if not err and not img_header.fits_as_is(len(img_content)):
+                    from src.imaging import convert_discord_img
+                    try:
+                        img_content, err = await contxt.run_image_job(convert_discord_img, img_content)
+                    except ImagePoolBusyError as e:
+                        err = str(e)
+            if not err:
+                err = await batch.upload(emote_name, img_content)
+            await batch.add_result(emote_name, err)
+
+        await asyncio.gather(*(steal_one(img_url, emote_name) for img_url, emote_name in requested_emotes))
+        await batch.finish()
+
+    @commands.command(help="Show per-stage latency and error stats (bot owner only).", usage=f"{BOT_PREFIX}stats")
+    @commands.is_owner()
+    async def stats(self, ctx) -> None:
+        lines = ["**Stage latencies** (count, avg, p95)"]
+        for stage, histogram in sorted(metrics.stage_latencies.items()):
+            avg_secs = histogram.sum / histogram.count if histogram.count else 0
+            lines.append(f"`{stage}`: {histogram.count}, {avg_secs:.2f}s, <={histogram.quantile(0.95)}s")
+        discord_errors = ", ".join(f"{err_code} x{count}" for err_code, count in metrics.discord_errors.most_common())
+        lines.append(f"**Discord errors**: {discord_errors or 'none'}")
+        lines.append(f"**Event loop lag** p95: <={metrics.loop_lag.quantile(0.95)}s")
+        lines.append(f"**Image pool**: {self.bot.image_pool.pending} pending jobs")
+        lines.append(f"**Upload queues**: {self.bot.upload_scheduler.total_waiting} waiting")
+        lines.append(f"**Image commands**: {self.bot.admission.running} running, {self.bot.admission.waiting} waiting")
+        lines.append(f"**Job queue**: {self.bot.job_queue.size} unfinished")
+        lines.append(f"**Cache**: {self.bot.emote_cache}")
+        await ctx.reply("\n".join(lines)[:2000])
+
     @commands.command(help="Get the invite link for the bot.", usage=f"{BOT_PREFIX}invite")
     async def invite(self, ctx) -> None:
         """ mote/grab  """
@@ -0,0 +1,31 @@
+import asyncio
+import discord
+from src.globals import EMBED_WAIT_SECS
+
+
+class EmbedWaiter:
+    """
+    Lets commands wait for discord to attach embeds to a message (which it does with a later message edit).
+    MyBot feeds every raw message edit to on_raw_message_edit, waking whoever is waiting on that message ID.
+    """
+    def __init__(self):
+        self.waiters: dict[int, asyncio.Future] = {} # message ID -> future resolved with its embeds
+
+    def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
+        future = self.waiters.get(payload.message_id)
+        embeds = payload.data.get("embeds")
+        if future and embeds and not future.done():
+            future.set_result([discord.Embed.from_dict(embed) for embed in embeds])
+
+    async def wait_for_embeds(self, message: discord.Message, timeout_secs: float = EMBED_WAIT_SECS) -> list[discord.Embed]:
+        """ Returns the message's embeds as soon as discord adds them, or [] if none arrive within timeout_secs """
+        if message.embeds: # already resolved, eg the edit arrived before the command ran
+            return message.embeds
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[message.id] = future
+        try:
+            return await asyncio.wait_for(future, timeout_secs)
+        except asyncio.TimeoutError:
+            return []
+        finally:
+            self.waiters.pop(message.id, None)
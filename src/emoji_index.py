@@ -0,0 +1,89 @@
+import hashlib
+import discord
+
+
+def hash_image(image: bytes) -> str:
+    return hashlib.sha256(image).hexdigest()
+
+
+class GuildEmojiIndex:
+    """
+    A guild's emoji names and static/animated counts, plus content hashes of the emojis the bot uploaded.
+    Uploads that are queued but not done yet are counted too, so concurrent uploads can't overfill the guild.
+    """
+    def __init__(self, guild: discord.Guild):
+        self.emoji_limit = guild.emoji_limit
+        self.names: dict[str, int] = {} # name -> emoji ID
+        self.counts = {False: 0, True: 0} # animated -> number of emojis
+        self.hashes: dict[str, int] = {} # content hash -> emoji ID
+        self.pending: dict[str, bool] = {} # name -> animated, for uploads in progress
+        self.rebuild(guild.emojis)
+
+    def rebuild(self, emojis: list[discord.Emoji]) -> None:
+        self.names = {emoji.name: emoji.id for emoji in emojis}
+        self.counts = {False: 0, True: 0}
+        for emoji in emojis:
+            self.counts[emoji.animated] += 1
+        emoji_ids = {emoji.id for emoji in emojis}
+        self.hashes = {image_hash: emoji_id for image_hash, emoji_id in self.hashes.items() if emoji_id in emoji_ids}
+
+    def check(self, name: str, animated: bool, image_hash: str) -> tuple[str, int]:
+        """ returns: (error_text, error_code) - the error the upload would fail with, if any """
+        if name in self.names or name in self.pending:
+            return f"An emote called `{name}` already exists on this server. Please choose another name.", -1
+        if image_hash in self.hashes:
+            # names keeps one ID per name, and discord allows duplicate names, so the emoji may not be found by ID
+            existing_name = next((name for name, emoji_id in self.names.items() if emoji_id == self.hashes[image_hash]), None)
+            if existing_name:
+                return f"That emote is already on this server, as `{existing_name}`.", -1
+            return "That emote is already on this server.", -1
+        num_pending = sum(1 for pending_animated in self.pending.values() if pending_animated == animated)
+        if self.counts[animated] + num_pending >= self.emoji_limit: # static and animated emojis have separate limits
+            return "Maximum number of emojis reached.", 30008
+        return "", 0
+
+
+class EmojiIndex:
+    """
+    Per-guild GuildEmojiIndexes, built from the guild's cached emojis the first time they're needed,
+    then kept up to date by MyBot.on_guild_emojis_update and by the bot's own uploads.
+    Pre-flight checks against it need no REST calls.
+    """
+    def __init__(self):
+        self.guilds: dict[int, GuildEmojiIndex] = {}
+
+    def get(self, guild: discord.Guild) -> GuildEmojiIndex:
+        if guild.id not in self.guilds:
+            self.guilds[guild.id] = GuildEmojiIndex(guild)
+        guild_index = self.guilds[guild.id]
+        guild_index.emoji_limit = guild.emoji_limit # changes with the guild's boost level
+        return guild_index
+
+    def on_guild_emojis_update(self, guild: discord.Guild, after: list[discord.Emoji]) -> None:
+        if guild.id in self.guilds:
+            self.guilds[guild.id].rebuild(after)
+
+    def on_guild_remove(self, guild: discord.Guild) -> None:
+        self.guilds.pop(guild.id, None)
+
+    def reserve(self, guild: discord.Guild, name: str, animated: bool, image_hash: str) -> tuple[str, int]:
+        """
+        Checks the upload against the index, and if it passes, holds its name and slot until release/record_upload.
+        returns: (error_text, error_code)
+        """
+        guild_index = self.get(guild)
+        err_text, err_code = guild_index.check(name, animated, image_hash)
+        if not err_text:
+            guild_index.pending[name] = animated
+        return err_text, err_code
+
+    def release(self, guild: discord.Guild, name: str) -> None:
+        self.get(guild).pending.pop(name, None)
+
+    def record_upload(self, guild: discord.Guild, emoji: discord.Emoji, image_hash: str) -> None:
+        guild_index = self.get(guild)
+        guild_index.pending.pop(emoji.name, None)
+        if emoji.name not in guild_index.names: # the emojis update event may have got here first
+            guild_index.names[emoji.name] = emoji.id
+            guild_index.counts[emoji.animated] += 1
+        guild_index.hashes[image_hash] = emoji.id
@@ -0,0 +1,177 @@
+import asyncio
+import copy
+import os
+import time
+from collections import OrderedDict
+from src.globals import (
+    EMOTE_INFO_TTL_SECS,
+    EMOTE_IMAGE_CACHE_BYTES,
+    EMOTE_CACHE_DIR,
+    EMOTE_DISK_CACHE_BYTES
+)
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0
+        return f"{self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate)"
+
+
+class TTLCache:
+    """ Holds values for ttl_secs after they are stored, and at most max_entries values at once """
+    def __init__(self, ttl_secs: float, max_entries: int = 4096):
+        self.ttl_secs = ttl_secs
+        self.max_entries = max_entries
+        self.entries: dict[str, tuple[float, object]] = {} # key -> (expiry time, value)
+        self.stats = CacheStats()
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.stats.hits += 1
+            return entry[1]
+        if entry: # expired
+            del self.entries[key]
+        self.stats.misses += 1
+        return None
+
+    def put(self, key: str, value) -> None:
+        self.entries.pop(key, None) # so re-stored keys move to the end
+        self.entries[key] = (time.monotonic() + self.ttl_secs, value)
+        if len(self.entries) > self.max_entries:
+            now = time.monotonic()
+            self.entries = {key: entry for key, entry in self.entries.items() if entry[0] > now}
+            while len(self.entries) > self.max_entries: # drop the oldest
+                del self.entries[next(iter(self.entries))]
+
+
+class ByteLRUCache:
+    """ Holds bytes values, evicting the least recently used once their total size exceeds max_bytes """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries: OrderedDict[str, bytes] = OrderedDict()
+        self.stats = CacheStats()
+
+    def get(self, key: str) -> bytes | None:
+        value = self.entries.get(key)
+        if value is None:
+            self.stats.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.total_bytes -= len(self.entries.pop(key))
+        self.entries[key] = value
+        self.total_bytes += len(value)
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+
+
+class DiskStore:
+    """
+    Keeps bytes values as files in dir_path so that they survive restarts.
+    Files are evicted oldest-access first once their total size exceeds max_bytes.
+    """
+    def __init__(self, dir_path: str, max_bytes: int):
+        self.dir_path = dir_path
+        self.max_bytes = max_bytes
+        os.makedirs(self.dir_path, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(self.dir_path) if entry.is_file())
+
+    def get(self, key: str) -> bytes | None:
+        file_path = os.path.join(self.dir_path, key)
+        try:
+            with open(file_path, "rb") as f:
+                value = f.read()
+            os.utime(file_path) # mark as recently used
+        except OSError:
+            return None
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        file_path = os.path.join(self.dir_path, key)
+        if os.path.exists(file_path):
+            return
+        temp_file_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temp_file_path, "wb") as f:
+            f.write(value)
+        os.replace(temp_file_path, file_path) # atomic, so shard processes sharing dir_path never read a partial file
+        self.total_bytes += len(value)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        entries = sorted((entry for entry in os.scandir(self.dir_path) if entry.is_file()), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError: # already evicted by another shard process
+                continue
+            self.total_bytes -= size
+
+
+class EmoteCache:
+    """
+    Two-tier cache keyed by 7TV emote ID:
+    - parsed Emote metadata, kept for a TTL
+    - the final Discord-ready image bytes, in a byte-budgeted LRU (optionally backed by a DiskStore)
+    """
+    def __init__(
+        self,
+        info_ttl_secs: float = EMOTE_INFO_TTL_SECS,
+        image_cache_bytes: int = EMOTE_IMAGE_CACHE_BYTES,
+        cache_dir: str = EMOTE_CACHE_DIR,
+        disk_cache_bytes: int = EMOTE_DISK_CACHE_BYTES
+    ):
+        self.info_cache = TTLCache(info_ttl_secs)
+        self.image_cache = ByteLRUCache(image_cache_bytes)
+        self.disk_store = DiskStore(cache_dir, disk_cache_bytes) if cache_dir else None
+        self.image_stats = CacheStats() # across both the memory and disk tiers
+
+    def __str__(self):
+        return f"EmoteCache(info: {self.info_cache.stats}, images: {self.image_stats})"
+
+    def get_emote(self, emote_id: str, suggested_emote_name: str | None = None):
+        """ Returns a copy of the cached Emote (renamed if suggested_emote_name is given), or None """
+        emote = self.info_cache.get(emote_id)
+        if not emote:
+            return None
+        emote = copy.copy(emote)
+        if suggested_emote_name:
+            emote.name = suggested_emote_name
+        return emote
+
+    def put_emote(self, emote_id: str, emote) -> None:
+        self.info_cache.put(emote_id, emote)
+
+    async def get_image(self, emote_id: str) -> bytes | None:
+        content = self.image_cache.get(emote_id)
+        if content is None and self.disk_store:
+            content = await asyncio.to_thread(self.disk_store.get, emote_id)
+            if content is not None:
+                self.image_cache.put(emote_id, content)
+        if content is None:
+            self.image_stats.misses += 1
+        else:
+            self.image_stats.hits += 1
+        return content
+
+    async def put_image(self, emote_id: str, content: bytes) -> None:
+        self.image_cache.put(emote_id, content)
+        if self.disk_store:
+            await asyncio.to_thread(self.disk_store.put, emote_id, content)
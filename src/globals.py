@@ -17,13 +17,74 @@ IMAGES_PATH = os.path.join(src_dir_path, "images")
 """ Bot """
 BOT_PREFIX = "mote/"
 BOT_INVITE_LINK = os.environ["BOT_INVITE_LINK"]
+BATCH_MAX_EMOTES = 50 # per grabmany/stealmany command
+BATCH_CONCURRENCY = 4 # emotes fetched/encoded at once per grabmany/stealmany command
+PROGRESS_EDIT_INTERVAL_SECS = 2 # min time between edits of a progress message
+
+""" Sharding """
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", 0)) # total shards across all processes - 0 for discord's recommended count
+SHARD_PROCESSES = int(os.environ.get("SHARD_PROCESSES", 1)) # processes on this host that the shards are split between
+SHARD_PROCESS_INDEX = int(os.environ.get("SHARD_PROCESS_INDEX", 0)) # set for each shard process by main.py
 
 """ Discord """
 MAX_EMOTE_SIZE_BYTES = 262144
+# discord.py's minimum - waits longer than this raise RateLimited instead of sleeping silently. It applies to every route, so
+# besides UploadScheduler (for emoji uploads), DiscordCtx's message sends and edits wait out RateLimited themselves
+MAX_RATELIMIT_TIMEOUT_SECS = 30
+MIN_EMOTE_SIDE = 32 # pixels - images are never shrunk below this on their shorter side
+MAX_EMOTE_SIDE = 128 # pixels - discord shows emojis at 128px at most, so resized images never exceed this on their shorter side
+EMOTE_FORMATS = ("PNG", "JPEG", "GIF", "WEBP") # accepted for emote uploads, though only GIFs are animated
+EMBED_WAIT_SECS = 3 # how long to wait for discord to embed a linked image, before using the link as it is
+
+""" HTTP """
+HTTP_CONNECTION_LIMIT = 100
+HTTP_CONNECTION_LIMIT_PER_HOST = 10
+HTTP_TIMEOUT_SECS = 30
+HTTP_CONNECT_TIMEOUT_SECS = 10
+MAX_DOWNLOAD_SIZE_BYTES = 8388608 # 8 MiB
+PROBE_BYTES = 16384 # read before the rest of an image download, to check its format and dimensions
+
+""" Image processing """
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", os.cpu_count() or 1))
+IMAGE_QUEUE_DEPTH = int(os.environ.get("IMAGE_QUEUE_DEPTH", 32)) # max jobs running + waiting before new ones are turned away
+MAX_ENCODE_ATTEMPTS = 6 # encodes tried while searching for the largest size that fits
+PALETTE_SAMPLE_FRAMES = 8 # frames sampled to build an animated image's shared palette
+LOSSY_QUALITY = 85 # JPEG and lossy WEBP quality, used for static emotes from photographic sources
+MAX_IMAGE_PIXELS = 16777216 # 4096x4096 - larger frames are rejected as decompression bombs
+MAX_TOTAL_PIXELS = 134217728 # summed over every frame, eg 512 frames of 512x512
+
+""" Admission control """
+COMMAND_MAX_RUNNING = int(os.environ.get("COMMAND_MAX_RUNNING", 16)) # image commands run at once - the rest wait, single-emote commands first
+COMMAND_MAX_WAITING = IMAGE_QUEUE_DEPTH # waiting image commands before new ones are told to retry later
+USER_COMMAND_RATE = 5 # image commands per user, per USER_COMMAND_PER_SECS
+USER_COMMAND_PER_SECS = 30
+GUILD_COMMAND_RATE = 20 # image commands per guild, per GUILD_COMMAND_PER_SECS
+GUILD_COMMAND_PER_SECS = 60
+
+""" Job queue """
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", os.path.join(src_dir_path, "jobs.db")) # shared by every shard process on the host
+JOB_MAX_ATTEMPTS = 3 # runs of a job (its first plus resumes) before it's given up on
+JOB_MAX_AGE_SECS = 3600 # older unfinished jobs aren't resumed, as the user has likely moved on
+
+""" Caching """
+EMOTE_INFO_TTL_SECS = 3600
+EMOTE_IMAGE_CACHE_BYTES = 67108864 # 64 MiB
+EMOTE_CACHE_DIR = os.environ.get("EMOTE_CACHE_DIR", "") # on-disk image cache that survives restarts - disabled if empty
+EMOTE_DISK_CACHE_BYTES = 536870912 # 512 MiB
+
+""" Metrics """
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9464)) # Prometheus endpoint at /metrics - 0 to disable
+LOOP_LAG_INTERVAL_SECS = 1
 
 """ Logging """
 log_dir_path = os.path.join(src_dir_path, "logs")
-LOG_FILE_PATH = os.path.join(log_dir_path, "bot.log")
+LOG_FILE_PATH = os.path.join(log_dir_path, "bot.log" if SHARD_PROCESSES == 1 else f"bot-{SHARD_PROCESS_INDEX}.log") # one per shard process, as rotation is not multi-process safe
+LOG_MAX_BYTES = 5242880 # 5 MiB - bot.log is rotated once it reaches this
+LOG_BACKUP_COUNT = 3
+LOG_JSON = os.environ.get("LOG_JSON", "False") # "True" to write bot.log as JSON lines
 
 """ 7TV """
-BASE_API_URL = "https://7tv.io/v3/emotes/"
\ No newline at end of file
+BASE_API_URL = "https://7tv.io/v3/emotes/"
+BASE_SET_API_URL = "https://7tv.io/v3/emote-sets/"
+SOURCE_FORMATS = ("AVIF", "WEBP") # 7TV file formats that are downloaded and transcoded locally
\ No newline at end of file
@@ -1,23 +1,46 @@
 from discord.ext import commands
+from functools import cache
+from typing import TYPE_CHECKING
+import asyncio
 import discord
+import copy
+import math
 import re
-import requests
-import os
-import re
-from PIL import Image, ImageSequence
-from io import BytesIO
+import time
 from src.globals import (
-    IMAGES_PATH,
-    MAX_EMOTE_SIZE_BYTES,
-    BASE_API_URL
+    BATCH_MAX_EMOTES,
+    MAX_DOWNLOAD_SIZE_BYTES,
+    PROBE_BYTES,
+    PROGRESS_EDIT_INTERVAL_SECS,
+    BASE_API_URL,
+    BASE_SET_API_URL,
+    SOURCE_FORMATS
 )
+from src.http_client import HttpClient
+from src.workspace import ImageWorkspace
+from src.emote_cache import EmoteCache
+from src.metrics import metrics
+from src.emoji_index import hash_image
+if TYPE_CHECKING: # src.imaging (and so Pillow) is only imported once an image is first handled, to keep startup fast
+    from src.imaging import ImageHeader
 
 
 """ Logging """
 
 from src.logs import MyLogger, ExecutionOutcome
-from src.globals import LOG_FILE_PATH
-my_logger = MyLogger(file_name="bot", log_file_path=LOG_FILE_PATH)
+from src.globals import LOG_FILE_PATH, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_JSON
+
+
+@cache
+def get_logger() -> MyLogger:
+    """ Created on first use, so importing this module doesn't open bot.log or start the log thread """
+    return MyLogger(
+        file_name="bot",
+        log_file_path=LOG_FILE_PATH,
+        max_bytes=LOG_MAX_BYTES,
+        backup_count=LOG_BACKUP_COUNT,
+        json_lines=LOG_JSON == "True"
+    )
 
 
 """ Discord context and messages """
@@ -40,46 +63,143 @@ class DiscordCtx:
         self.has_emoji_perms = self.ctx.message.author.guild_permissions.manage_emojis
         self.bot_message = None # this will be updated to whatever the bot eventually sends
         self.attachments = self.ctx.message.attachments
+        self.curr_message = None
+        # progress edits are coalesced to at most one per PROGRESS_EDIT_INTERVAL_SECS
+        self.pending_edit: tuple[str, str, ExecutionOutcome] | None = None # (content, message to log, exec_outcome)
+        self.last_edit_time = 0.0
+        self.edit_lock = asyncio.Lock() # keeps edits in order
+        self.flush_task: asyncio.Task | None = None
 
     async def send_msg(self, message, exec_outcome=ExecutionOutcome.DEFAULT, add_loading_icon: bool = False) -> None:
         msg = emojify_str(message, exec_outcome, add_loading_icon)
-        self.curr_message = await self.ctx.send(msg)
-        my_logger.log_message(self.ctx, message, exec_outcome)
+        resumed_message = getattr(self.ctx, "status_message", None) # set by MyBot.resume_jobs
+        if resumed_message:
+            self.ctx.status_message = None
+            self.curr_message = await wait_out_rate_limits(resumed_message.edit, content=msg) # carry on in the message the user was left with
+        else:
+            self.curr_message = await wait_out_rate_limits(self.ctx.send, msg)
+        self.last_edit_time = time.monotonic()
+        job_id = getattr(self.ctx, "job_id", None)
+        if job_id is not None:
+            await self.ctx.bot.job_queue.set_status_message(job_id, self.curr_message.id)
+        get_logger().log_message(self.ctx, message, exec_outcome)
 
     async def edit_msg(self, message: str, exec_outcome=ExecutionOutcome.DEFAULT, add_loading_icon: bool = False) -> None:
+        """
+        Progress updates (add_loading_icon) made too soon after the last edit are held back, and only the latest is sent once
+        the interval is up. Any other edit is the final state, and is sent straight away in place of any held-back update.
+        """
         if not self.curr_message:
             return
-        msg = emojify_str(message, exec_outcome, add_loading_icon)
-        await self.curr_message.edit(content=msg)
-        my_logger.log_message(self.ctx, message, exec_outcome)
+        self.pending_edit = (emojify_str(message, exec_outcome, add_loading_icon), message, exec_outcome)
+        if add_loading_icon:
+            wait_secs = self.last_edit_time + PROGRESS_EDIT_INTERVAL_SECS - time.monotonic()
+            if wait_secs > 0:
+                if not self.flush_task:
+                    self.flush_task = asyncio.create_task(self.flush_edit_later(wait_secs))
+                return
+        await self.flush_edit()
+
+    async def flush_edit_later(self, delay_secs: float) -> None:
+        await asyncio.sleep(delay_secs)
+        self.flush_task = None
+        await self.flush_edit()
+
+    async def flush_edit(self) -> None:
+        async with self.edit_lock:
+            while self.pending_edit: # otherwise already sent by a later call
+                msg, message, exec_outcome = self.pending_edit
+                self.pending_edit = None
+                self.last_edit_time = time.monotonic()
+                try:
+                    await self.curr_message.edit(content=msg)
+                except discord.RateLimited as e: # see MAX_RATELIMIT_TIMEOUT_SECS
+                    self.pending_edit = self.pending_edit or (msg, message, exec_outcome) # unless a newer edit came in meanwhile
+                    await asyncio.sleep(e.retry_after)
+                    continue
+                get_logger().log_message(self.ctx, message, exec_outcome)
 
     async def reply_to_user(self, message, exec_outcome=ExecutionOutcome.DEFAULT, ping: bool = False, add_loading_icon: bool = False) -> None:
         msg = emojify_str(message, exec_outcome, add_loading_icon)
-        await self.ctx.reply(msg, mention_author=ping)
-        my_logger.log_message(self.ctx, message, exec_outcome)
+        await wait_out_rate_limits(self.ctx.reply, msg, mention_author=ping)
+        get_logger().log_message(self.ctx, message, exec_outcome)
 
-    async def get_replied_message(self) -> discord.Message | None:
+    async def convert_in_workspace(self, func, workspace: ImageWorkspace) -> str:
+        """
+        Runs func (eg convert_discord_img) on the workspace's image in the image pool, storing the result back in the workspace.
+        returns: error
+        Raises ImagePoolBusyError if the pool is saturated.
+        """
+        converted_content, error = await self.run_image_job(func, workspace.read())
+        if error:
+            return error
+        workspace.replace(converted_content)
+        return ""
+
+    async def run_image_job(self, func, *args):
+        """
+        Runs a Pillow function in the bot's image pool, letting the user know if it has to wait for a worker.
+        Raises ImagePoolBusyError if the pool is saturated.
+        """
+        image_pool = self.ctx.bot.image_pool
+        queue_position = image_pool.queue_position
+        if queue_position and not image_pool.is_saturated:
+            await self.edit_msg(f"Waiting for a free image worker... (position {queue_position} in queue)", add_loading_icon=True)
+        async with metrics.time_stage("image_encode"):
+            return await image_pool.run(func, *args)
+
+    async def get_replied_message(self, with_reactions: bool = False) -> discord.Message | None:
+        """
+        From the reply itself or the bot's message cache if possible, only fetching it as a last resort.
+        with_reactions always fetches it, as the bot doesn't get reaction events to keep cached copies' reactions up to date.
+        """
         referenced_message = self.ctx.message.reference
         if referenced_message:
+            if with_reactions and referenced_message.message_id:
+                return await self.ctx.message.channel.fetch_message(referenced_message.message_id)
+            if isinstance(referenced_message.resolved, discord.Message):
+                return referenced_message.resolved
+            if referenced_message.cached_message:
+                return referenced_message.cached_message
             if referenced_message.message_id:
                 return await self.ctx.message.channel.fetch_message(referenced_message.message_id)
 
-    async def upload_emoji_to_server(self, emote_name: str, image_path: str) -> tuple[str, int]:
+    async def upload_emoji_to_server(self, emote_name: str, image: bytes, report_queue: bool = True, more_to_come: bool = False) -> tuple[str, int]:
         """
+        Uploads through the bot's UploadScheduler, telling the user their queue position/ETA if report_queue is set.
+        The command's admission slot is given up while it waits on the scheduler, and only taken back if more_to_come.
         returns (error_text, error_code)
         err_code of 0 is no error. err_code of -1 is an unspecified error.
         """
         if not self.has_emoji_perms:
             return "You do not have sufficient permissions to use this command.", -1
-        if not self.ctx.guild:
+        guild = self.ctx.guild
+        if not guild:
             return "Guild somehow not found??? Internal server error!!", -1
+        # skip doomed uploads (duplicates, or no free slot) without a round trip to discord
+        emoji_index = self.ctx.bot.emoji_index
+        image_hash = hash_image(image)
+        from src.imaging import image_is_animated
+        err_text, err_code = emoji_index.reserve(guild, emote_name, image_is_animated(image), image_hash)
+        if err_text:
+            return err_text, err_code
+
+        upload_scheduler = self.ctx.bot.upload_scheduler
+        on_rate_limited = None
+        if report_queue:
+            uploads_ahead, eta_secs = upload_scheduler.estimate(guild.id)
+            if uploads_ahead or eta_secs >= 1:
+                await self.edit_msg(f"Queued for upload (position {uploads_ahead + 1}, about {math.ceil(eta_secs)}s)...", add_loading_icon=True)
+            async def on_rate_limited(wait_secs: float) -> None:
+                await self.edit_msg(f"Rate limited by Discord, uploading in about {math.ceil(wait_secs)}s...", add_loading_icon=True)
         try:
-            with open(image_path, "rb") as img:
-                image = img.read()
-            await self.ctx.guild.create_custom_emoji(name=emote_name, image=image)
+            async with self.ctx.bot.admission.suspended(self.ctx, resume=more_to_come):
+                emoji = await upload_scheduler.upload(guild, emote_name, image, on_rate_limited)
+            emoji_index.record_upload(guild, emoji, image_hash)
         except discord.errors.HTTPException as e:
             err_message, err_code = get_discord_err_info(e.args[0])
-            my_logger.log_message(self.ctx, err_message, ExecutionOutcome.ERROR) # log message
+            metrics.discord_errors[err_code] += 1
+            get_logger().log_message(self.ctx, err_message, ExecutionOutcome.ERROR) # log message
             match err_code:
                 case 30008:
                     err_message = "Maximum number of emojis reached."
@@ -90,6 +210,8 @@ class DiscordCtx:
                 case 50045:
                     err_message = "Emote name must be between 2 and 32 characters long.\nPlease provide a shorter name to override the 7TV name if not done so already."
             return err_message, err_code
+        finally:
+            emoji_index.release(guild, emote_name)
         return "", 0
 
     @staticmethod
@@ -105,6 +227,74 @@ class DiscordCtx:
         emote_url = f"https://cdn.discordapp.com/emojis/{emote_id}.{file_extension}"
         return emote_url, emote_name
 
+    @staticmethod
+    def get_all_emote_info_from_message(discord_message: discord.Message) -> list[tuple[str, str]]:
+        """ returns: [(emote_url, emote_name), ...] for every distinct custom emote in the message's content and reactions """
+        emotes = {} # emote ID -> (emote_url, emote_name)
+        for is_animated, emote_name, emote_id in re.findall(r"<(a?):(\w+):(\d+)>", discord_message.content):
+            file_extension = "gif" if is_animated else "png"
+            emotes.setdefault(emote_id, (f"https://cdn.discordapp.com/emojis/{emote_id}.{file_extension}", emote_name))
+        for reaction in discord_message.reactions:
+            if reaction.is_custom_emoji() and reaction.emoji.id:
+                emotes.setdefault(str(reaction.emoji.id), (str(reaction.emoji.url), reaction.emoji.name))
+        return list(emotes.values())
+
+
+class BatchUpload:
+    """
+    One progress message and a per-emote summary for commands that upload several emotes at once.
+    Uploads may be started concurrently - the bot's upload scheduler runs them one at a time per guild.
+    """
+    def __init__(self, contxt: DiscordCtx, num_emotes: int, action: str, skipped: list[str] | None = None):
+        self.contxt = contxt
+        self.num_emotes = num_emotes
+        self.action = action # eg "Grabbing"
+        self.skipped = skipped or [] # names of the emotes left out for being over BATCH_MAX_EMOTES
+        self.results: list[tuple[str, str]] = [] # (emote_name, error)
+        self.server_full = False
+
+    async def upload(self, emote_name: str, image: bytes) -> str:
+        """ returns: error """
+        if self.server_full:
+            return "Maximum number of emojis reached."
+        more_to_come = len(self.results) + 1 < self.num_emotes
+        err, err_code = await self.contxt.upload_emoji_to_server(emote_name, image, report_queue=False, more_to_come=more_to_come)
+        self.server_full = self.server_full or err_code == 30008
+        return err
+
+    async def add_result(self, emote_name: str, err: str) -> None:
+        self.results.append((emote_name, err))
+        await self.contxt.edit_msg(f"{self.action} emotes... ({len(self.results)}/{self.num_emotes} done)", add_loading_icon=True)
+
+    async def finish(self) -> None:
+        failures = [f"`{emote_name}`: {err}" for emote_name, err in self.results if err]
+        summary = f"Uploaded {self.num_emotes - len(failures)}/{self.num_emotes} emotes."
+        if self.skipped:
+            skipped_names = ", ".join(f"`{emote_name}`" for emote_name in self.skipped)
+            if len(skipped_names) > 900:
+                skipped_names = skipped_names[:900].rsplit(", ", 1)[0] + ", ..."
+            summary += f"\nSkipped {len(self.skipped)} more, over the limit of {BATCH_MAX_EMOTES} per command: {skipped_names}"
+        if not failures:
+            exec_outcome = ExecutionOutcome.WARNING if self.skipped else ExecutionOutcome.SUCCESS
+            return await self.contxt.edit_msg(summary, exec_outcome)
+        failure_lines = "\n".join(failures)
+        if len(failure_lines) > 900: # keep within discord's message length limit, along with the summary
+            failure_lines = failure_lines[:900].rsplit("\n", 1)[0] + "\n..."
+        exec_outcome = ExecutionOutcome.ERROR if len(failures) == self.num_emotes else ExecutionOutcome.WARNING
+        await self.contxt.edit_msg(f"{summary}\n{failure_lines}", exec_outcome)
+
+
+async def wait_out_rate_limits(send_func, *args, **kwargs):
+    """
+    Awaits send_func(*args, **kwargs), sleeping through and retrying any rate limit too long for discord.py to wait out itself.
+    The bot's max_ratelimit_timeout applies to every route, not just emoji uploads (see MAX_RATELIMIT_TIMEOUT_SECS).
+    """
+    while True:
+        try:
+            return await send_func(*args, **kwargs)
+        except discord.RateLimited as e:
+            await asyncio.sleep(e.retry_after)
+
 
 def emojify_str(msg, exec_outcome: ExecutionOutcome, add_loading_icon: bool = False):
     """
@@ -140,129 +330,157 @@ def is_valid_7tv_url(url: str) -> bool:
     return bool(results)
 
 
+def is_valid_7tv_set_url(url: str) -> bool:
+    results = re.search(r"^(https://|http://)7tv.app/emote-sets/([\w]+)$", url)
+    return bool(results)
+
+
 def get_7tv_api_url(command_url: str) -> str:
     emote_id = command_url.split("/")[-1]
     return BASE_API_URL + emote_id
 
 
-def retrieve_7tv_image_info(api_url: str, suggested_emote_name=None) -> tuple[Emote|None, str]:
-    response = requests.get(api_url)
-    if response.status_code != 200:
+async def retrieve_7tv_image_info(http_client: HttpClient, api_url: str, suggested_emote_name=None, emote_cache: EmoteCache | None = None) -> tuple[Emote|None, str]:
+    emote_id = api_url.split("/")[-1]
+    if emote_cache:
+        emote = emote_cache.get_emote(emote_id, suggested_emote_name)
+        if emote:
+            return emote, ""
+
+    async with metrics.time_stage("7tv_api"):
+        data, err = await http_client.get_json(api_url)
+    if not data:
         return None, "Could not load URL."
-    data = response.json()
 
+    from src.imaging import can_decode
     _7v_id = data["id"]
-    emote_name = suggested_emote_name if suggested_emote_name else data["name"]
     is_animated = data["animated"]
-    emote_format = "gif" if data["animated"] else "png"
 
-    emote_versions = data["host"]["files"]
-    webp_emote_versions = [version for version in emote_versions if version["format"] == "WEBP"]
-    # largest to smallest valid versions, containing at least size 1x
-    if not webp_emote_versions:
+    # the smallest decodable file of each scale (1x to 4x) - it is transcoded locally, so the format only affects download size
+    smallest_versions = {}
+    for version in data["host"]["files"]:
+        if version["format"] not in SOURCE_FORMATS or not can_decode(version["format"]):
+            continue
+        scale = version["name"].split(".")[0]
+        if scale not in smallest_versions or version["size"] < smallest_versions[scale]["size"]:
+            smallest_versions[scale] = version
+    # largest to smallest, as larger versions can be fitted more sharply
+    valid_versions = sorted(
+        (version for version in smallest_versions.values() if version["size"] <= MAX_DOWNLOAD_SIZE_BYTES),
+        key=lambda version: version["name"],
+        reverse=True
+    )
+    if not valid_versions:
         return None, "No valid image versions available to download."
-    valid_versions = [webp_emote_versions[0]]
-    for version in webp_emote_versions[1:]: # assuming sorted 1x to 4x
-        # find the largest version that is smaller than the max discord emoji size
-        if (version["size"] <= MAX_EMOTE_SIZE_BYTES):
-            valid_versions.insert(0, version) # prepend
-    # store urls for all sizes below the max discord emote size
     valid_dl_urls = []
     for version in valid_versions:
-        image_size_and_format = version["name"].replace("webp", emote_format)
-        dl_url = f"{data['host']['url']}/{image_size_and_format}"
+        dl_url = f"{data['host']['url']}/{version['name']}"
         if not dl_url.startswith("https:"):
             dl_url = "https:" + dl_url
         valid_dl_urls.append(dl_url)
 
     emote = Emote(
-        name=emote_name,
+        name=data["name"],
         _7v_id=_7v_id,
         dl_urls=valid_dl_urls,
         animated=is_animated,
-        format=emote_format
+        format=valid_versions[0]["format"].lower()
     )
+    if emote_cache:
+        emote_cache.put_emote(emote_id, emote)
+        emote = copy.copy(emote) # so renaming doesn't touch the cached emote
+    if suggested_emote_name:
+        emote.name = suggested_emote_name
     return emote, ""
 
 
-def download_7tv_image(img_url: str, format: str) -> tuple[str, str]:
-    response = requests.get(img_url)
-    if response.status_code != 200:
-        return "", "Unable to download image."
-    img_path = os.path.join(IMAGES_PATH, f"download.{format.lower()}") # eg download.gif
-    with open(img_path, "wb") as img:
-        img.write(response.content)
-    return img_path, ""
+async def retrieve_7tv_emote_set(http_client: HttpClient, set_url: str) -> tuple[list[tuple[str, str]], str]:
+    """ returns: ([(emote_api_url, emote_name), ...], error) """
+    set_id = set_url.split("/")[-1]
+    async with metrics.time_stage("7tv_api"):
+        data, err = await http_client.get_json(BASE_SET_API_URL + set_id)
+    if not data:
+        return [], "Could not load URL."
+    # names are the set's aliases for each emote, which can differ from the emote's own name
+    emotes = [(BASE_API_URL + set_emote["id"], set_emote["name"]) for set_emote in data.get("emotes") or []]
+    if not emotes:
+        return [], "That emote set is empty."
+    return emotes, ""
 
 
-def download_discord_img(img_url: str) -> tuple[str, int, str]:
-    """ returns: (image_path, image_size, error) """
-    
-    # including a user-agent in case some websites require it
-    response = requests.get(img_url, headers={
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.99 Safari/537.36'
-    })
-    if response.status_code != 200:
-        return "", 0, f"Unable to download image (status code {response.status_code})."
-    img = Image.open(BytesIO(response.content))
-    if not img.format:
-        return "", 0, "Error while processing the image format."
-    downloaded_path = os.path.join(IMAGES_PATH, f"download.{img.format.lower()}")
-    img.save(downloaded_path, save_all=True)
-    try:
-        img_file_size = os.path.getsize(downloaded_path)
-    except OSError:
-        return "", 0, "Error while analysing the image size."
-    return downloaded_path, img_file_size, ""
-
-
-def is_animated(filepath: str) -> bool:
-    media = Image.open(filepath)
-    idx = 0
-    for _ in ImageSequence.Iterator(media):
-        idx += 1
-    return idx > 1 # true if more than one frame
-
-
-def resize_img(img_path: str) -> tuple[str, str]:
-    optimal_dimensions = get_optimal_frame_size(img_path)
-    if is_animated(img_path): # ie an animated gif
-        img = Image.open(img_path)
-        resized_frames = []
-        for idx in range(img.n_frames):
-            img.seek(idx)
-            resized_frame = img.resize(optimal_dimensions)
-            resized_frames.append(resized_frame)
-        try:
-            resized_frames[0].save(img_path, save_all=True, append_images=resized_frames[1:], loop=0, optimize=True)
-        except Exception as e:
-            return "", f"Unable to resize image: {e}"
-    else: # not animated
-        try:
-            img = Image.open(img_path)
-            img.thumbnail(optimal_dimensions, Image.Resampling.LANCZOS)
-            img.save(img_path, optimize=True)
-        except Exception as e:
-            return "", f"Unable to resize image: {e}"
-    return img_path, ""
-   
-
-def get_optimal_frame_size(img_path: str) -> tuple[int, int]:
-    img = Image.open(img_path)
-    width, height = img.size
-    # set the smaller dimension to 32, and scale the larger dimension from there
-    if width > height:
-        new_height = 32
-        new_width = 32 * (width / height)
-    else: # height >= width
-        new_width = 32
-        new_height = 32 * (height / width)
-    return int(new_width), int(new_height)
-
-
-def convert_discord_img(img_path: str, img_size: int) -> tuple[str, str]:
-    if img_size > MAX_EMOTE_SIZE_BYTES:
-        img_path, error = resize_img(img_path)
-        if error:
-            return "", error
-    return img_path, ""
\ No newline at end of file
+async def download_7tv_image(http_client: HttpClient, img_url: str, workspace: ImageWorkspace) -> tuple[int, str]:
+    """ Downloads into the workspace, replacing whatever it held. returns: (image_size, error) """
+    workspace.clear()
+    async with metrics.time_stage("7tv_cdn_download"):
+        return await http_client.download_to(img_url, workspace)
+
+
+async def download_discord_img(http_client: HttpClient, img_url: str, workspace: ImageWorkspace) -> tuple["ImageHeader | None", str]:
+    """
+    Downloads into the workspace, replacing whatever it held.
+    The download is abandoned as soon as its first bytes show it isn't a supported image, or is too large to decode.
+    returns: (image_header, error)
+    """
+    from src.imaging import probe_header
+    workspace.clear()
+    probed_headers = []
+
+    def probe(head: bytes, content_length: int | None, content_type: str) -> str:
+        if content_type and not content_type.startswith("image/") and content_type != "application/octet-stream":
+            return "That link is not an image."
+        complete = len(head) < PROBE_BYTES or (content_length is not None and content_length <= len(head))
+        header, err = probe_header(head, complete)
+        probed_headers.append(header)
+        return err
+
+    async with metrics.time_stage("image_download"):
+        _, err = await http_client.download_to(img_url, workspace, probe=probe)
+    if err:
+        return None, err
+    if not probed_headers[0]: # its header runs past the first PROBE_BYTES
+        return probe_header(workspace.read())
+    return probed_headers[0], ""
+
+
+async def get_7tv_emote(bot: commands.Bot, api_url: str, suggested_emote_name=None) -> tuple[Emote|None, str]:
+    """ Like retrieve_7tv_image_info, but concurrent requests for the same emote share a single fetch """
+    emote_id = api_url.split("/")[-1]
+    emote, err = await bot.single_flight.run(("7tv_info", emote_id), retrieve_7tv_image_info, bot.http_client, api_url, None, bot.emote_cache)
+    if not emote:
+        return None, err
+    emote = copy.copy(emote) # the shared result may be handed to several callers
+    if suggested_emote_name:
+        emote.name = suggested_emote_name
+    return emote, ""
+
+
+async def get_7tv_emote_image(contxt: DiscordCtx, emote: Emote) -> tuple[bytes, str]:
+    """
+    Returns the emote's Discord-ready image, from the cache if possible.
+    Concurrent requests for the same emote and size share a single download and encode (and contxt's image worker updates).
+    returns: (image_content, error)
+    Raises ImagePoolBusyError if the image pool is saturated.
+    """
+    bot = contxt.ctx.bot
+    cached_content = await bot.emote_cache.get_image(emote._7v_id)
+    if cached_content:
+        return cached_content, ""
+    # download the largest version, which is then transcoded to fit within discord's size limit
+    dl_url = emote.dl_urls[0]
+    return await bot.single_flight.run(("7tv_image", emote._7v_id, dl_url), fetch_7tv_emote_image, contxt, emote._7v_id, dl_url)
+
+
+async def fetch_7tv_emote_image(contxt: DiscordCtx, emote_id: str, dl_url: str) -> tuple[bytes, str]:
+    """ returns: (image_content, error) """
+    from src.imaging import transcode
+    bot = contxt.ctx.bot
+    with ImageWorkspace() as workspace:
+        img_size, err = await download_7tv_image(bot.http_client, dl_url, workspace)
+        if not img_size:
+            return b"", err
+        img_content = workspace.read()
+    img_content, err = await contxt.run_image_job(transcode, img_content)
+    if err:
+        return b"", err
+    await bot.emote_cache.put_image(emote_id, img_content)
+    return img_content, ""
@@ -0,0 +1,139 @@
+import asyncio
+import ipaddress
+from typing import Any, Callable
+import aiohttp
+from src.globals import (
+    HTTP_CONNECTION_LIMIT,
+    HTTP_CONNECTION_LIMIT_PER_HOST,
+    HTTP_TIMEOUT_SECS,
+    HTTP_CONNECT_TIMEOUT_SECS,
+    MAX_DOWNLOAD_SIZE_BYTES,
+    PROBE_BYTES
+)
+
+
+# including a user-agent in case some websites require it
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.99 Safari/537.36"
+CHUNK_SIZE_BYTES = 65536
+
+
+class BlockedAddressError(aiohttp.ClientError):
+    """ Raised when a URL's host is (or resolves to) an address that isn't on the public internet """
+
+
+def is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0]) # drop any IPv6 zone
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+class PublicOnlyConnector(aiohttp.TCPConnector):
+    """
+    Refuses to connect anywhere but the public internet (no loopback, private, link-local, etc. addresses),
+    as users can make the bot download any link. Checked after DNS resolution, and again for every redirect.
+    """
+    async def _resolve_host(self, host: str, port: int, traces=None) -> list[dict[str, Any]]:
+        # aiohttp's own hook for resolution - IP literals skip the resolver, so it's the only place that sees every address
+        hosts = await super()._resolve_host(host, port, traces=traces)
+        if not all(is_public_address(host_info["host"]) for host_info in hosts):
+            raise BlockedAddressError(f"{host} is not a public address")
+        return hosts
+
+
+class HttpClient:
+    """
+    A single pooled, keep-alive aiohttp session shared for the lifetime of the bot.
+    Opened by the first request that needs it, and closed when the bot shuts down.
+    """
+    def __init__(
+        self,
+        limit: int = HTTP_CONNECTION_LIMIT,
+        limit_per_host: int = HTTP_CONNECTION_LIMIT_PER_HOST,
+        timeout_secs: float = HTTP_TIMEOUT_SECS,
+        connect_timeout_secs: float = HTTP_CONNECT_TIMEOUT_SECS,
+        max_body_bytes: int = MAX_DOWNLOAD_SIZE_BYTES,
+        public_only: bool = True
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout_secs, connect=connect_timeout_secs)
+        self.max_body_bytes = max_body_bytes
+        self.public_only = public_only
+        self.session: aiohttp.ClientSession | None = None
+
+    async def open(self) -> None:
+        if self.session and not self.session.closed:
+            return
+        connector_class = PublicOnlyConnector if self.public_only else aiohttp.TCPConnector
+        connector = connector_class(limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            headers={"User-Agent": USER_AGENT}
+        )
+
+    async def close(self) -> None:
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def get_json(self, url: str) -> tuple[dict | None, str]:
+        """ returns: (json_data, error) """
+        await self.open()
+        try:
+            async with self.session.get(url) as response:
+                if response.status != 200:
+                    return None, f"Request failed (status code {response.status})."
+                return await response.json(), ""
+        except asyncio.TimeoutError:
+            return None, "Request timed out."
+        except (aiohttp.ClientError, ValueError) as e:
+            return None, f"Request failed: {e}"
+
+    async def download_to(
+        self,
+        url: str,
+        sink,
+        max_bytes: int | None = None,
+        probe: Callable[[bytes, int | None, str], str] | None = None
+    ) -> tuple[int, str]:
+        """
+        Streams the response body into sink (anything with a write method), aborting as soon as it exceeds max_bytes.
+        probe(head, content_length, content_type) is called once the first PROBE_BYTES (or the whole body, if smaller) arrive -
+        if it returns an error, the download is abandoned there.
+        returns: (bytes_written, error)
+        """
+        await self.open()
+        max_bytes = max_bytes or self.max_body_bytes
+        too_large_err = f"File too large to download (over {max_bytes // 1048576} MB)."
+        try:
+            async with self.session.get(url) as response:
+                if response.status != 200:
+                    return 0, f"Unable to download image (status code {response.status})."
+                if response.content_length and response.content_length > max_bytes:
+                    return 0, too_large_err
+                bytes_written = 0
+                head = bytearray()
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE_BYTES):
+                    bytes_written += len(chunk)
+                    if bytes_written > max_bytes:
+                        return 0, too_large_err
+                    sink.write(chunk)
+                    if probe and len(head) < PROBE_BYTES:
+                        head += chunk
+                        if len(head) >= PROBE_BYTES:
+                            err = probe(bytes(head), response.content_length, response.content_type)
+                            if err:
+                                return 0, err
+                if probe and len(head) < PROBE_BYTES: # the whole body was smaller than PROBE_BYTES
+                    err = probe(bytes(head), response.content_length, response.content_type)
+                    if err:
+                        return 0, err
+                return bytes_written, ""
+        except asyncio.TimeoutError:
+            return 0, "Timed out while downloading the image."
+        except BlockedAddressError:
+            return 0, "That link is not allowed."
+        except aiohttp.ClientError as e:
+            return 0, f"Unable to download image: {e}"
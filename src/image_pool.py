@@ -0,0 +1,65 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+from src.globals import IMAGE_WORKERS, IMAGE_QUEUE_DEPTH
+
+
+class ImagePoolBusyError(Exception):
+    """ Raised when the image pool's queue is full """
+
+
+class ImagePool:
+    """
+    Runs CPU-heavy Pillow work in a ProcessPoolExecutor, so that it never blocks the event loop.
+    Jobs beyond max_queue_depth are rejected rather than left to pile up.
+    """
+    def __init__(self, max_workers: int = IMAGE_WORKERS, max_queue_depth: int = IMAGE_QUEUE_DEPTH):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.pending = 0 # jobs submitted and not yet finished (running + queued)
+        self.executor: ProcessPoolExecutor | None = None
+
+    def start(self) -> None:
+        if self.executor:
+            return
+        # spawn rather than fork, as forking a process with running threads (aiohttp, logging) is unsafe
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def shutdown(self) -> None:
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+
+    @property
+    def queue_position(self) -> int:
+        """ Position a new job would take in the queue (0 if a worker is free) """
+        return max(0, self.pending - self.max_workers + 1)
+
+    @property
+    def is_saturated(self) -> bool:
+        return self.pending >= self.max_queue_depth
+
+    async def run(self, func: Callable, *args) -> Any:
+        """
+        Runs func(*args) in a worker process and returns its result.
+        func must be a picklable module-level function.
+        """
+        if self.is_saturated:
+            raise ImagePoolBusyError("The bot is busy processing other images, please try again in a moment.")
+        self.start()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self.executor
+            try:
+                return await loop.run_in_executor(executor, func, *args)
+            except BrokenProcessPool:
+                # a worker died (eg killed for using too much memory) - replace the pool and retry once
+                if self.executor is executor: # other jobs on the broken pool may have replaced it already
+                    self.shutdown()
+                    self.start()
+                return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
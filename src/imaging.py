@@ -0,0 +1,350 @@
+import math
+from PIL import Image, ImageSequence, UnidentifiedImageError
+from io import BytesIO
+from src.globals import (
+    MAX_EMOTE_SIZE_BYTES,
+    MIN_EMOTE_SIDE,
+    MAX_EMOTE_SIDE,
+    MAX_ENCODE_ATTEMPTS,
+    PALETTE_SAMPLE_FRAMES,
+    LOSSY_QUALITY,
+    EMOTE_FORMATS,
+    MAX_IMAGE_PIXELS,
+    MAX_TOTAL_PIXELS
+)
+
+
+STATIC_OUTPUT_FORMATS = ("PNG", "WEBP") # lossless - tried for each static emote, keeping the smallest
+PHOTO_OUTPUT_FORMATS = ("JPEG", "WEBP") # lossy - tried instead for photographic sources, where lossless only preserves noise
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS # Pillow itself refuses anything over twice this
+
+""" Image processing - runs inside the image pool's worker processes, so avoid importing discord here """
+
+def is_animated(img: Image.Image) -> bool:
+    return getattr(img, "is_animated", False) # only multi-frame formats define this
+
+
+def image_is_animated(content: bytes) -> bool:
+    """ Cheap - Pillow only reads as far as the second frame's header """
+    try:
+        return is_animated(Image.open(BytesIO(content)))
+    except Exception:
+        return False
+
+
+class ImageHeader:
+    """ What an image's first few KB say about it, before the rest is downloaded """
+    def __init__(self, img_format: str, width: int, height: int, n_frames: int | None):
+        self.format = img_format
+        self.width = width
+        self.height = height
+        self.n_frames = n_frames # None if it can't be known without the whole file (eg GIF, animated WEBP)
+
+    def __str__(self):
+        return f"ImageHeader(format={self.format}, size={self.width}x{self.height}, n_frames={self.n_frames})"
+
+    def fits_as_is(self, content_size: int, max_bytes: int = MAX_EMOTE_SIZE_BYTES) -> bool:
+        """ Whether the image can be uploaded without going through transcode """
+        if content_size > max_bytes:
+            return False
+        return self.format == "GIF" or (self.format in EMOTE_FORMATS and self.n_frames == 1)
+
+
+def probe_header(head: bytes, complete: bool = True) -> tuple[ImageHeader | None, str]:
+    """
+    Reads the format and dimensions from the start of an image, checking them against the decompression-bomb limits.
+    If head is only the start of the file and the header runs past it (eg a JPEG with a large EXIF or ICC block),
+    returns (None, "") - the whole file has to be probed once downloaded.
+    returns: (image_header, error)
+    """
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        header = parse_webp_header(head) # Pillow's WEBP decoder needs the whole file
+    else:
+        try:
+            img = Image.open(BytesIO(head)) # lazy - only reads the header
+        except Image.DecompressionBombError:
+            return None, "Image dimensions are too large."
+        except Exception:
+            header = None
+        else:
+            n_frames = None if img.format == "GIF" else getattr(img, "n_frames", 1) # counting GIF frames needs every frame
+            header = ImageHeader(img.format, *img.size, n_frames)
+    if not header:
+        return None, "" if not complete else "That file is not an image in a supported format."
+    error = check_pixel_limits(header.width, header.height, header.n_frames or 1)
+    if error:
+        return None, error
+    return header, ""
+
+
+def parse_webp_header(head: bytes) -> ImageHeader | None:
+    """ Reads the dimensions from the first chunk of a WEBP file """
+    chunk_type = head[12:16]
+    if chunk_type == b"VP8X" and len(head) >= 30: # extended - the only kind that can be animated
+        is_animated = head[20] & 0x02
+        width = int.from_bytes(head[24:27], "little") + 1
+        height = int.from_bytes(head[27:30], "little") + 1
+        return ImageHeader("WEBP", width, height, None if is_animated else 1)
+    if chunk_type == b"VP8L" and len(head) >= 25: # lossless
+        bits = int.from_bytes(head[21:25], "little")
+        return ImageHeader("WEBP", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, 1)
+    if chunk_type == b"VP8 " and len(head) >= 30: # lossy
+        width = int.from_bytes(head[26:28], "little") & 0x3FFF
+        height = int.from_bytes(head[28:30], "little") & 0x3FFF
+        return ImageHeader("WEBP", width, height, 1)
+    return None
+
+
+def check_pixel_limits(width: int, height: int, n_frames: int = 1) -> str:
+    """ returns: error, if decoding the image could use too much memory or time """
+    if width * height > MAX_IMAGE_PIXELS:
+        return f"Image dimensions are too large ({width}x{height})."
+    if width * height * n_frames > MAX_TOTAL_PIXELS:
+        return f"Image has too many frames at its size ({n_frames} frames of {width}x{height})."
+    return ""
+
+
+def can_decode(img_format: str) -> bool:
+    """ Whether this Pillow build has a decoder for the format, e.g. AVIF needs a plugin or Pillow >= 11.3 """
+    Image.init()
+    return img_format.upper() in Image.OPEN
+
+
+def fits_as_is(img: Image.Image, content: bytes, max_bytes: int) -> bool:
+    """ Whether the image can be uploaded without re-encoding """
+    if len(content) > max_bytes:
+        return False
+    if is_animated(img):
+        return img.format == "GIF" # any other animated format would upload as a still
+    return img.format in EMOTE_FORMATS
+
+
+def resize_img(
+    content: bytes,
+    dimensions: tuple[int, int] | None = None,
+    colors: int = 256,
+    frame_step: int = 1,
+    static_format: str | None = None,
+    lossy: bool = False
+) -> tuple[bytes, str]:
+    """
+    Re-encodes the image at the given dimensions (default: get_optimal_frame_size).
+    Animated images are always re-encoded as GIFs - colors caps the shared palette size and frame_step keeps every nth frame.
+    Static images are re-encoded as static_format (default: their own format), at LOSSY_QUALITY if lossy.
+    returns: (resized_content, error)
+    """
+    try:
+        img = Image.open(BytesIO(content))
+        dimensions = dimensions or get_optimal_frame_size(img)
+        output = BytesIO()
+        if is_animated(img):
+            palette = build_shared_palette(img, dimensions, colors)
+            # filled in as frames are yielded - Pillow only reads durations[i]/disposals[i] once frame i exists
+            durations, disposals = [], []
+            frames = iter_resized_frames(img, dimensions, palette, frame_step, durations, disposals)
+            first_frame = next(frames)
+            if len(range(0, img.n_frames, frame_step)) == 1: # Pillow's single-frame writer can't take per-frame lists
+                first_frame.save(output, format="GIF", transparency=first_frame.info["transparency"], optimize=True)
+            else:
+                first_frame.save(
+                    output, format="GIF", save_all=True, append_images=frames,
+                    transparency=first_frame.info["transparency"], duration=durations, disposal=disposals, loop=0, optimize=True
+                )
+        else: # not animated
+            img_format = static_format or img.format
+            img.thumbnail(dimensions, Image.Resampling.LANCZOS)
+            save_static(img, output, img_format, lossy)
+    except Exception as e:
+        return b"", f"Unable to resize image: {e}"
+    return output.getvalue(), ""
+
+
+def save_static(img: Image.Image, output: BytesIO, img_format: str, lossy: bool = False) -> None:
+    if img_format == "WEBP":
+        if lossy:
+            img.save(output, format="WEBP", quality=LOSSY_QUALITY, method=6)
+        else:
+            img.save(output, format="WEBP", lossless=True, method=6)
+    elif img_format == "JPEG":
+        if img.mode not in ("RGB", "L"): # JPEG has no alpha or palette
+            img = img.convert("RGB")
+        img.save(output, format="JPEG", quality=LOSSY_QUALITY, optimize=True)
+    else:
+        img.save(output, format=img_format, optimize=True)
+
+
+def is_photographic(img: Image.Image, content: bytes) -> bool:
+    """ Whether the source was lossily compressed, so a lossless re-encode would only preserve its artifacts """
+    if img.format == "JPEG":
+        return True
+    return img.format == "WEBP" and content[12:16] == b"VP8 " # simple lossy WEBP, which has no alpha
+
+
+def build_shared_palette(img: Image.Image, dimensions: tuple[int, int], colors: int) -> Image.Image:
+    """
+    Quantizes a strip of evenly spaced, resized frames into a single palette used by every frame.
+    One fewer than colors is used, leaving an index free for transparency.
+    """
+    num_samples = min(img.n_frames, PALETTE_SAMPLE_FRAMES)
+    sample_idxs = sorted({round(i * (img.n_frames - 1) / max(num_samples - 1, 1)) for i in range(num_samples)})
+    frame_width, frame_height = dimensions
+    strip = Image.new("RGB", (frame_width * len(sample_idxs), frame_height))
+    for position, idx in enumerate(sample_idxs):
+        img.seek(idx)
+        frame = img.convert("RGBA").resize(dimensions, Image.Resampling.LANCZOS)
+        strip.paste(frame, (position * frame_width, 0), mask=frame)
+    return strip.quantize(colors - 1, method=Image.Quantize.MEDIANCUT)
+
+
+def iter_resized_frames(img: Image.Image, dimensions: tuple[int, int], palette: Image.Image, frame_step: int, durations: list[int], disposals: list[int]):
+    """
+    Yields resized, palette-mapped frames one at a time, so only the current source frame is ever held at full size.
+    Each frame's duration and disposal are appended to durations/disposals.
+    Dropped frames' durations are added to the kept frame before them.
+    """
+    palette_colors = palette.getpalette()
+    transparent_idx = len(palette_colors) // 3
+    pending_frame = None
+    for idx, source_frame in enumerate(ImageSequence.Iterator(img)):
+        duration = source_frame.info.get("duration", 100)
+        if idx % frame_step:
+            durations[-1] += duration
+            continue
+        if pending_frame:
+            yield pending_frame
+        rgba_frame = source_frame.convert("RGBA").resize(dimensions, Image.Resampling.LANCZOS)
+        frame = rgba_frame.convert("RGB").quantize(palette=palette, dither=Image.Dither.FLOYDSTEINBERG)
+        frame.putpalette(palette_colors + [0, 0, 0]) # add the transparent colour
+        transparent_mask = rgba_frame.getchannel("A").point(lambda alpha: 255 if alpha < 128 else 0, mode="1")
+        frame.paste(transparent_idx, mask=transparent_mask)
+        frame.info["transparency"] = transparent_idx
+        # frames are fully composited, so any frame with transparency must clear the previous one
+        has_transparency = transparent_mask.getbbox() is not None
+        durations.append(duration)
+        disposals.append(2 if has_transparency else getattr(img, "disposal_method", 1) or 1)
+        pending_frame = frame
+    yield pending_frame
+
+
+def fit_to_size(
+    content: bytes,
+    max_bytes: int = MAX_EMOTE_SIZE_BYTES,
+    static_format: str | None = None,
+    lossy: bool = False
+) -> tuple[bytes, str]:
+    """
+    Finds the largest dimensions, up to MAX_EMOTE_SIDE, that encode to at most max_bytes, so only a single upload is needed.
+    Tries MAX_EMOTE_SIDE first, then starts from a guess based on the size ratio and binary searches on the shorter side.
+    If even MIN_EMOTE_SIDE is too large, reduces the palette and drops frames instead.
+    Static images are encoded as static_format (default: their own format), lossily if lossy, and animated ones as GIFs.
+    returns: (fitted_content, error)
+    """
+    try:
+        img = Image.open(BytesIO(content))
+    except Exception as e:
+        return b"", f"Unable to resize image: {e}"
+    output_format = "GIF" if is_animated(img) else static_format or img.format
+    # a different output format may fit at full size, so that is tried too
+    needs_reencode = img.format != output_format
+    if len(content) <= max_bytes and not needs_reencode:
+        return content, ""
+
+    width, height = img.size
+    top_side = min(width, height, MAX_EMOTE_SIDE)
+    top_content = content
+    if top_side < min(width, height) or needs_reencode:
+        # anything larger than discord shows is wasted bytes, so downscale before searching
+        top_content, error = resize_img(content, scale_to_side(width, height, top_side), static_format=output_format, lossy=lossy)
+        if error:
+            return b"", error
+        if len(top_content) <= max_bytes:
+            return top_content, ""
+    low, high = MIN_EMOTE_SIDE, top_side - 1
+    # encoded size scales roughly with area, so scale each side by the square root of the size ratio
+    guess = int(top_side * math.sqrt(max_bytes / len(top_content)))
+    best_content = b""
+    for _ in range(MAX_ENCODE_ATTEMPTS):
+        if low > high:
+            break
+        guess = min(max(guess, low), high)
+        resized_content, error = resize_img(content, scale_to_side(width, height, guess), static_format=output_format, lossy=lossy)
+        if error:
+            return b"", error
+        if len(resized_content) <= max_bytes:
+            best_content = resized_content
+            low = guess + 1
+        else:
+            high = guess - 1
+        guess = (low + high) // 2
+    if best_content:
+        return best_content, ""
+
+    # still too large at the smallest size, so trade away colours, then frames
+    min_dimensions = scale_to_side(width, height, MIN_EMOTE_SIDE)
+    for colors, frame_step in ((256, 1), (128, 1), (64, 1), (64, 2), (32, 3)):
+        resized_content, error = resize_img(content, min_dimensions, colors, frame_step, output_format, lossy)
+        if error:
+            return b"", error
+        if len(resized_content) <= max_bytes:
+            return resized_content, ""
+    return b"", "Image too large and could not be resized to fit on the server."
+
+
+def scale_to_side(width: int, height: int, shortest_side: int) -> tuple[int, int]:
+    """ Scales (width, height) so that the shorter side is shortest_side, keeping the aspect ratio """
+    if width > height:
+        return int(shortest_side * (width / height)), shortest_side
+    return shortest_side, int(shortest_side * (height / width))
+
+
+def get_optimal_frame_size(img: Image.Image) -> tuple[int, int]:
+    # set the smaller dimension to 32, and scale the larger dimension from there
+    return scale_to_side(*img.size, MIN_EMOTE_SIDE)
+
+
+def transcode(content: bytes, max_bytes: int = MAX_EMOTE_SIZE_BYTES) -> tuple[bytes, str]:
+    """
+    Encodes any image Pillow can decode (e.g. WEBP, AVIF) into the smallest emote discord accepts, within max_bytes.
+    Images discord would accept as they are are returned unchanged.
+    Otherwise animated images become GIFs, and static images whichever of STATIC_OUTPUT_FORMATS
+    (or PHOTO_OUTPUT_FORMATS, for photographic sources) encodes smallest at MAX_EMOTE_SIDE.
+    returns: (transcoded_content, error)
+    """
+    try:
+        img = Image.open(BytesIO(content)) # lazy - only reads the header
+    except UnidentifiedImageError:
+        return b"", "Error while processing the image format."
+    except Image.DecompressionBombError:
+        return b"", "Image dimensions are too large."
+    if not img.format:
+        return b"", "Error while processing the image format."
+    try:
+        n_frames = getattr(img, "n_frames", 1) # scans every frame of a GIF, but doesn't decode them
+    except Exception as e:
+        return b"", f"Unable to read image: {e}"
+    error = check_pixel_limits(*img.size, n_frames)
+    if error:
+        return b"", error
+    if fits_as_is(img, content, max_bytes):
+        return content, ""
+    if is_animated(img):
+        return fit_to_size(content, max_bytes)
+
+    lossy = is_photographic(img, content)
+    # compare formats at the size the emote will be shown at - which compresses best at full size doesn't matter
+    dimensions = scale_to_side(*img.size, min(*img.size, MAX_EMOTE_SIDE))
+    encoded = {}
+    for img_format in PHOTO_OUTPUT_FORMATS if lossy else STATIC_OUTPUT_FORMATS:
+        encoded[img_format], error = resize_img(content, dimensions, static_format=img_format, lossy=lossy)
+        if error:
+            return b"", error
+    smallest_format = min(encoded, key=lambda img_format: len(encoded[img_format]))
+    if len(encoded[smallest_format]) <= max_bytes:
+        return encoded[smallest_format], ""
+    # shrink further, in whichever format compressed best
+    return fit_to_size(content, max_bytes, smallest_format, lossy)
+
+
+def convert_discord_img(content: bytes) -> tuple[bytes, str]:
+    """ returns: (converted_content, error) """
+    return transcode(content)
@@ -0,0 +1,105 @@
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, NamedTuple
+from discord.ext import commands
+from src.globals import JOB_DB_PATH
+
+
+class Job(NamedTuple):
+    job_id: int
+    guild_id: int
+    channel_id: int
+    message_id: int # the command message
+    status_message_id: int | None # the bot's hourglass message, once sent
+    attempts: int
+    created_at: float # unix time
+
+
+class JobQueue:
+    """
+    Records every resumable command (grab/upload/steal) in SQLite from when it's admitted until it finishes,
+    so that commands cut off by a restart or crash can be run again by MyBot.resume_jobs.
+    Shard processes on one host share the database, each resuming the jobs of its own guilds.
+    All database work happens on a single thread of its own, so disk writes and lock waits never block the event loop.
+    """
+    def __init__(self, db_path: str = JOB_DB_PATH):
+        self.db_path = db_path
+        self.db: sqlite3.Connection | None = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-queue")
+        self.opened_at = 0.0
+        self.closed = False
+        self.size = 0 # unfinished jobs - counted across every shard process on opening, then kept up to date with this process's writes
+
+    async def open(self) -> None:
+        await self.run(self.connect)
+
+    def connect(self) -> None:
+        if self.db:
+            return
+        self.db = sqlite3.connect(self.db_path, isolation_level=None, timeout=5) # autocommit - every write is a single statement
+        self.db.execute("PRAGMA journal_mode=WAL") # lets shard processes read while another writes
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id INTEGER PRIMARY KEY,
+                guild_id INTEGER NOT NULL,
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                status_message_id INTEGER,
+                attempts INTEGER NOT NULL DEFAULT 1,
+                created_at REAL NOT NULL
+            )
+        """)
+        self.opened_at = time.time()
+        self.size = self.db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    async def close(self) -> None:
+        if self.closed:
+            return
+        def disconnect() -> None:
+            if self.db:
+                self.db.close()
+            self.db = None
+        await self.run(disconnect)
+        self.closed = True
+        self.executor.shutdown()
+
+    async def run(self, func: Callable, *args) -> Any:
+        """ Runs func(*args) on the database thread - a no-op once closed, eg for commands still running at shutdown """
+        if self.closed:
+            return None
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        """ Only call on the database thread """
+        self.connect()
+        cursor = self.db.execute(sql, params)
+        if sql.startswith("INSERT"):
+            self.size += cursor.rowcount
+        elif sql.startswith("DELETE"):
+            self.size -= cursor.rowcount
+        return cursor
+
+    async def enqueue(self, ctx: commands.Context) -> int:
+        """ returns: the new job's ID """
+        sql = "INSERT INTO jobs (guild_id, channel_id, message_id, created_at) VALUES (?, ?, ?, ?)"
+        params = (ctx.guild.id, ctx.channel.id, ctx.message.id, time.time())
+        return await self.run(lambda: self.execute(sql, params).lastrowid)
+
+    async def set_status_message(self, job_id: int, status_message_id: int) -> None:
+        await self.run(self.execute, "UPDATE jobs SET status_message_id = ? WHERE job_id = ?", (status_message_id, job_id))
+
+    async def record_attempt(self, job_id: int) -> None:
+        await self.run(self.execute, "UPDATE jobs SET attempts = attempts + 1 WHERE job_id = ?", (job_id,))
+
+    async def finish(self, job_id: int) -> None:
+        await self.run(self.execute, "DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    async def unfinished(self) -> list[Job]:
+        """ Jobs left over from before this process opened the queue, oldest first """
+        await self.open() # sets opened_at
+        sql = "SELECT * FROM jobs WHERE created_at < ? ORDER BY job_id"
+        rows = await self.run(lambda: self.execute(sql, (self.opened_at,)).fetchall())
+        return [Job(*row) for row in rows]
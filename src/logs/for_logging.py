@@ -1,5 +1,10 @@
+import atexit
+import json
 import logging
+import queue
+import threading
 from enum import Enum
+from logging.handlers import QueueHandler, RotatingFileHandler
 from discord.ext import commands
 
 
@@ -10,34 +15,138 @@ class ExecutionOutcome(Enum):
     SUCCESS = -1
 
 
+class BatchFlushMixin:
+    """ Leaves writes in the stream's buffer until flush_batch is called, so a burst of records costs a single write """
+    def flush(self) -> None:
+        pass
+
+    def flush_batch(self) -> None:
+        super().flush()
+
+
+class BatchStreamHandler(BatchFlushMixin, logging.StreamHandler):
+    pass
+
+
+class BatchRotatingFileHandler(BatchFlushMixin, RotatingFileHandler):
+    pass
+
+
+class JsonFormatter(logging.Formatter):
+    """ One JSON object per line, including any structured fields passed via extra= """
+    STRUCTURED_FIELDS = ("guild_id", "channel_id", "exec_outcome")
+
+    def format(self, record: logging.LogRecord) -> str:
+        log_line = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for field in self.STRUCTURED_FIELDS:
+            if hasattr(record, field):
+                log_line[field] = getattr(record, field)
+        return json.dumps(log_line)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """ Queues records untouched - QueueHandler.prepare would otherwise format them on the caller's thread """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class LogListener:
+    """ Background thread that pulls records off the queue and writes them in batches """
+    def __init__(self, log_queue: queue.SimpleQueue, *handlers: logging.Handler, max_batch_size: int = 256):
+        self.log_queue = log_queue
+        self.handlers = handlers
+        self.max_batch_size = max_batch_size
+        self.thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name="log-listener", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        if not self.thread:
+            return
+        self.log_queue.put(None) # sentinel
+        self.thread.join()
+        self.thread = None
+
+    def run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = [self.log_queue.get()] # block until there is something to write
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self.log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            for record in batch:
+                if record is None:
+                    stopping = True
+                    continue
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            for handler in self.handlers:
+                handler.flush_batch()
+
+
 class MyLogger:
-    def __init__(self, file_name, log_file_path):
+    def __init__(self, file_name, log_file_path, max_bytes: int = 5242880, backup_count: int = 3, json_lines: bool = False):
         self.file_name = file_name
         self.log_file_path = log_file_path # log file path
 
-        # logger
+        # logger - only enqueues records, the listener thread does the formatting and writing
+        self.log_queue = queue.SimpleQueue()
         self.logger = logging.getLogger(self.file_name)
-        self.logger.setLevel(logging.DEBUG) # unless a handler is specified otherwise, will log DEBUG and above
+        if self.logger.level == logging.NOTSET: # eg the benchmarks quieten it before it's first used
+            self.logger.setLevel(logging.DEBUG) # unless a handler is specified otherwise, will log DEBUG and above
+        self.logger.addHandler(DeferredQueueHandler(self.log_queue))
 
-        # logger handler for the log file
-        self.file_handler = logging.FileHandler(self.log_file_path)
+        # handler for the log file, rotated once it reaches max_bytes
+        self.file_handler = BatchRotatingFileHandler(self.log_file_path, maxBytes=max_bytes, backupCount=backup_count)
         self.file_handler.setLevel(logging.ERROR) # only log to file for ERRORS and above
-        self.file_formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s') # format of log lines
+        if json_lines:
+            self.file_formatter = JsonFormatter()
+        else:
+            self.file_formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s') # format of log lines
         self.file_handler.setFormatter(self.file_formatter)
-        self.logger.addHandler(self.file_handler)
 
-        # logger handler for the to console - will log all things (debug and above)
-        self.stream_handler = logging.StreamHandler()
+        # handler for the console - will log all things (debug and above)
+        self.stream_handler = BatchStreamHandler()
         self.stream_formatter = logging.Formatter('%(levelname)s:%(name)s:%(message)s')
         self.stream_handler.setFormatter(self.stream_formatter)
-        self.logger.addHandler( self.stream_handler)
+
+        self.listener = LogListener(self.log_queue, self.file_handler, self.stream_handler)
+        self.listener.start()
+        atexit.register(self.stop) # write out anything still queued
+
+    def stop(self) -> None:
+        self.listener.stop()
 
     def log_message(self, ctx: commands.Context, bot_message: str, exec_outcome=ExecutionOutcome.DEFAULT) -> None:
-        single_line_bot_message = bot_message.replace('\n', ' ')
-        log_msg = f"({ctx.guild}, {ctx.channel}) {ctx.message.content} --> {single_line_bot_message}"
+        # formatting is deferred to the listener thread via %-style args
+        extra = {
+            "guild_id": ctx.guild.id if ctx.guild else None,
+            "channel_id": ctx.channel.id,
+            "exec_outcome": exec_outcome.name
+        }
+        log_args = ("(%s, %s) %s --> %s", ctx.guild, ctx.channel, ctx.message.content, SingleLine(bot_message))
         if exec_outcome == ExecutionOutcome.DEFAULT or exec_outcome == ExecutionOutcome.SUCCESS:
-            self.logger.info(log_msg)
+            self.logger.info(*log_args, extra=extra)
         elif exec_outcome == ExecutionOutcome.WARNING:
-            self.logger.warning(log_msg)
+            self.logger.warning(*log_args, extra=extra)
         elif exec_outcome == ExecutionOutcome.ERROR:
-            self.logger.error(log_msg)
\ No newline at end of file
+            self.logger.error(*log_args, extra=extra)
+
+
+class SingleLine:
+    """ Replaces newlines only when the record is formatted """
+    def __init__(self, text: str):
+        self.text = text
+
+    def __str__(self):
+        return self.text.replace('\n', ' ')
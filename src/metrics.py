@@ -0,0 +1,145 @@
+import asyncio
+import sys
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Callable
+from src.globals import LOOP_LAG_INTERVAL_SECS
+if TYPE_CHECKING: # aiohttp.web is only imported once the metrics server starts
+    from aiohttp import web
+
+
+LATENCY_BUCKETS_SECS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """ Prometheus-style cumulative histogram """
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS_SECS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets) # non-cumulative, summed when rendered
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for idx, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.bucket_counts[idx] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        """ Upper bound of the bucket holding the q-th quantile (inf if it is past the largest bucket) """
+        target = q * self.count
+        cumulative = 0
+        for upper_bound, bucket_count in zip(self.buckets, self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return upper_bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Per-stage latency histograms, discord error-code counts and event-loop lag,
+    rendered in the Prometheus text format for the metrics endpoint.
+    """
+    def __init__(self):
+        self.stage_latencies: dict[str, Histogram] = {}
+        self.discord_errors: Counter[int] = Counter()
+        self.loop_lag = Histogram()
+        self.gauges: dict[str, Callable[[], float]] = {} # name -> function returning the current value
+        self.startup_secs: dict[str, float] = {} # startup milestone -> seconds since the process started
+
+    def observe_stage(self, stage: str, secs: float) -> None:
+        if stage not in self.stage_latencies:
+            self.stage_latencies[stage] = Histogram()
+        self.stage_latencies[stage].observe(secs)
+
+    @asynccontextmanager
+    async def time_stage(self, stage: str):
+        """ async with metrics.time_stage("cdn_download"): ... """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start_time)
+
+    def mark_startup(self, milestone: str, process_start_time: float) -> None:
+        """ process_start_time is a time.perf_counter() taken as the process started """
+        self.startup_secs[milestone] = time.perf_counter() - process_start_time
+
+    def add_gauge(self, name: str, get_value: Callable[[], float]) -> None:
+        self.gauges[name] = get_value
+
+    async def monitor_loop_lag(self, interval_secs: float = LOOP_LAG_INTERVAL_SECS) -> None:
+        """ Runs forever, recording how late the event loop wakes up from a sleep """
+        while True:
+            start_time = time.perf_counter()
+            await asyncio.sleep(interval_secs)
+            self.loop_lag.observe(max(0.0, time.perf_counter() - start_time - interval_secs))
+
+    def render(self) -> str:
+        """ Prometheus text exposition format """
+        lines = ["# TYPE mote_stage_latency_seconds histogram"]
+        for stage, histogram in self.stage_latencies.items():
+            lines += render_histogram("mote_stage_latency_seconds", histogram, f'stage="{stage}"')
+        lines.append("# TYPE mote_discord_errors_total counter")
+        for err_code, count in self.discord_errors.items():
+            lines.append(f'mote_discord_errors_total{{code="{err_code}"}} {count}')
+        lines.append("# TYPE mote_event_loop_lag_seconds histogram")
+        lines += render_histogram("mote_event_loop_lag_seconds", self.loop_lag)
+        lines.append("# TYPE mote_startup_seconds gauge")
+        for milestone, secs in self.startup_secs.items():
+            lines.append(f'mote_startup_seconds{{milestone="{milestone}"}} {secs}')
+        for name, get_value in self.gauges.items():
+            lines.append(f"# TYPE mote_{name} gauge")
+            lines.append(f"mote_{name} {get_value()}")
+        return "\n".join(lines) + "\n"
+
+
+def render_histogram(name: str, histogram: Histogram, labels: str = "") -> list[str]:
+    label_prefix = f"{labels}," if labels else ""
+    lines = []
+    cumulative = 0
+    for upper_bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+        cumulative += bucket_count
+        lines.append(f'{name}_bucket{{{label_prefix}le="{upper_bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{label_prefix}le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+class MetricsServer:
+    """ Serves GET /metrics on a local port """
+    def __init__(self, metrics: Metrics, host: str, port: int):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.runner: "web.AppRunner | None" = None
+
+    async def start(self) -> None:
+        """ Metrics are optional, so a port that's already taken (eg by another bot on the host) only logs an error """
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, self.host, self.port).start()
+        except OSError as e:
+            print(f"Metrics server not started on {self.host}:{self.port}: {e}", file=sys.stderr)
+            await self.stop()
+
+    async def stop(self) -> None:
+        if self.runner:
+            await self.runner.cleanup()
+        self.runner = None
+
+    async def handle_metrics(self, request: "web.Request") -> "web.Response":
+        from aiohttp import web
+        return web.Response(text=self.metrics.render(), content_type="text/plain")
+
+
+metrics = Metrics()
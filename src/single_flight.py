@@ -0,0 +1,24 @@
+import asyncio
+from typing import Any, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller starts the work,
+    and everyone else asking for that key while it is in flight awaits the same task.
+    """
+    def __init__(self):
+        self.in_flight: dict[Hashable, asyncio.Task] = {}
+        self.shared_calls = 0 # calls that piggybacked on another caller's task
+
+    async def run(self, key: Hashable, func: Callable, *args) -> Any:
+        """ Returns the result of await func(*args), shared with any concurrent calls using the same key """
+        task = self.in_flight.get(key)
+        if task:
+            self.shared_calls += 1
+        else:
+            task = asyncio.create_task(func(*args))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # shielded, so one caller being cancelled doesn't cancel the work for everyone else
+        return await asyncio.shield(task)
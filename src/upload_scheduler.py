@@ -0,0 +1,101 @@
+import asyncio
+import re
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable
+import aiohttp
+import discord
+from src.metrics import metrics
+
+
+EMOJI_ROUTE_PATTERN = re.compile(r"/guilds/(\d+)/emojis$")
+
+
+class GuildUploadQueue:
+    """ Upload queue and last known emoji rate-limit budget for a single guild """
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.waiting = 0 # uploads blocked on the lock
+        self.remaining: int | None = None # None until discord has told us
+        self.reset_at = 0.0 # time.monotonic() at which the bucket refills
+        self.avg_upload_secs = 1.0
+
+    @property
+    def wait_secs(self) -> float:
+        """ How long until the bucket allows another upload """
+        if self.remaining == 0:
+            return max(0.0, self.reset_at - time.monotonic())
+        return 0.0
+
+
+class UploadScheduler:
+    """
+    Queues create_custom_emoji calls per guild, tracking the emoji rate-limit budget from discord's response headers.
+    Pass trace_config to the bot (http_trace) so that every emoji upload response is seen.
+    """
+    def __init__(self):
+        self.queues: defaultdict[int, GuildUploadQueue] = defaultdict(GuildUploadQueue)
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_request_end.append(self.on_request_end)
+
+    async def on_request_end(self, session, trace_config_ctx, params: aiohttp.TraceRequestEndParams) -> None:
+        if params.method != "POST":
+            return
+        match = EMOJI_ROUTE_PATTERN.search(params.url.path)
+        if not match:
+            return
+        queue = self.queues[int(match.group(1))]
+        headers = params.response.headers
+        if "X-RateLimit-Remaining" in headers:
+            queue.remaining = int(headers["X-RateLimit-Remaining"])
+        if "X-RateLimit-Reset-After" in headers:
+            queue.reset_at = time.monotonic() + float(headers["X-RateLimit-Reset-After"])
+
+    @property
+    def total_waiting(self) -> int:
+        return sum(queue.waiting for queue in self.queues.values())
+
+    def estimate(self, guild_id: int) -> tuple[int, float]:
+        """ returns: (uploads_ahead, eta_secs) for an upload queued now """
+        queue = self.queues[guild_id]
+        uploads_ahead = queue.waiting + int(queue.lock.locked())
+        return uploads_ahead, queue.wait_secs + uploads_ahead * queue.avg_upload_secs
+
+    async def upload(
+        self,
+        guild: discord.Guild,
+        name: str,
+        image: bytes,
+        on_rate_limited: Callable[[float], Awaitable[None]] | None = None
+    ) -> discord.Emoji:
+        """
+        Uploads once every earlier upload for the guild is done and the rate-limit bucket allows it.
+        on_rate_limited(wait_secs) is awaited whenever the upload has to wait on discord's rate limit.
+        Raises discord.HTTPException (other than for rate limits) if the upload fails.
+        """
+        queue = self.queues[guild.id]
+        queue.waiting += 1
+        try:
+            async with metrics.time_stage("upload_queue_wait"):
+                await queue.lock.acquire()
+        finally:
+            queue.waiting -= 1
+        try:
+            while True:
+                if queue.wait_secs:
+                    if on_rate_limited:
+                        await on_rate_limited(queue.wait_secs)
+                    await asyncio.sleep(queue.wait_secs)
+                start_time = time.monotonic()
+                try:
+                    emoji = await guild.create_custom_emoji(name=name, image=image)
+                except discord.errors.RateLimited as e: # only raised for waits over the bot's max_ratelimit_timeout
+                    queue.remaining = 0
+                    queue.reset_at = time.monotonic() + e.retry_after
+                    continue
+                finally:
+                    metrics.observe_stage("create_custom_emoji", time.monotonic() - start_time)
+                queue.avg_upload_secs = 0.8 * queue.avg_upload_secs + 0.2 * (time.monotonic() - start_time)
+                return emoji
+        finally:
+            queue.lock.release()
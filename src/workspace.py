@@ -0,0 +1,43 @@
+import uuid
+from io import BytesIO
+
+
+class ImageWorkspace:
+    """
+    Request-scoped buffer holding the current version of an image as it moves through download -> convert -> upload.
+    Each workspace has its own in-memory buffer, and nothing ever touches the disk - callers read the whole image anyway.
+    Use as a context manager - the buffer is always released on exit.
+    """
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.buffer = BytesIO()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __str__(self):
+        return f"ImageWorkspace(id={self.id}, size={self.size})"
+
+    @property
+    def size(self) -> int:
+        return self.buffer.seek(0, 2) # seek to the end
+
+    def write(self, data: bytes) -> int:
+        return self.buffer.write(data)
+
+    def read(self) -> bytes:
+        return self.buffer.getvalue()
+
+    def clear(self) -> None:
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def replace(self, data: bytes) -> None:
+        self.clear()
+        self.write(data)
+
+    def close(self) -> None:
+        self.buffer.close()